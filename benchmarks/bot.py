@@ -0,0 +1,260 @@
+"""End to end benchmarks of the bot against a fake Mumble server, a fake YouTube API and synthetic audio
+
+Measures the feed loop CPU per second of audio, the silence between tracks and after !skip, command round trip
+latency through message_received, the time from !yt to queued with a stubbed downloader, and random picks from a
+library of --rows tracks. Results are written as JSON, so runs on different commits can be compared:
+
+    python benchmarks/bot.py --output before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot import utils  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.bot import Musabot, load_config  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.models import db, Video, init_db  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.player import SAMPLE_RATE, BYTES_PER_SECOND  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.shuffle import ShuffleBag  # noqa: E402 pylint: disable=wrong-import-position
+from fakes import FakeMumble, FakeText, FakeYouTube  # noqa: E402 pylint: disable=wrong-import-position
+
+TRACK_SECONDS = 20
+OWNER = 'benchmark-owner'
+
+
+def write_track(directory, videoid, seconds):
+    """Writes a decoded synthetic track straight into the PCM cache"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pcm = (np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2')
+    pcm.tofile(os.path.join(directory, f'{videoid}.pcm'))
+
+
+def touch(filedir, videoid):
+    """Puts an empty stand-in for a downloaded file in place, returns its manifest fields"""
+    path = os.path.join(filedir, videoid)
+    with open(path, 'wb'):
+        pass
+    stat = os.stat(path)
+    return {'file_size': stat.st_size, 'file_mtime': stat.st_mtime}
+
+
+def add_track(config, number, seconds=TRACK_SECONDS):
+    url, videoid = utils.canonical_youtube_url(f'bench{number:06d}')
+    write_track(config['cachedir'], videoid, seconds)
+    Video.insert(id=videoid, url=url, title=f'Synthetic track {number}', duration=seconds,
+                 **touch(config['filedir'], videoid)).on_conflict_replace().execute()
+    return Video.get_by_id(videoid).as_dict()
+
+
+def fill_library(rows, filedir):
+    with db.atomic():
+        for start in range(0, rows, 10000):
+            Video.insert_many([{'id': f'{i:064x}', 'url': f'https://youtu.be/{i}', 'title': f'Library track {i}',
+                                **touch(filedir, f'{i:064x}')}
+                               for i in range(start, min(rows, start + 10000))]).execute()
+
+
+class BenchBot(Musabot):
+    """Downloads are replaced by writing a synthetic track"""
+
+    def download_youtube(self, job, url, urlhash, videoid):
+        write_track(self.config['cachedir'], urlhash, TRACK_SECONDS)
+        video = {'id': urlhash, 'url': url, 'title': f'Synthetic {videoid}', 'duration': TRACK_SECONDS,
+                 **touch(self.filedir, urlhash)}
+        return self.db_create_video(video)
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {'count': len(samples), 'mean_ms': statistics.mean(samples) * 1000,
+            'p50_ms': samples[len(samples) // 2] * 1000, 'p95_ms': samples[int(len(samples) * 0.95)] * 1000,
+            'max_ms': samples[-1] * 1000}
+
+
+def play(bot, stop_when):
+    """Runs the feed loop on a thread until stop_when() is true"""
+    thread = threading.Thread(target=bot.loop, daemon=True)
+    bot.playnext()
+    thread.start()
+    while not stop_when():
+        time.sleep(0.01)
+    bot.exit = True
+    thread.join()
+    bot.exit = False
+    bot.stop()
+
+
+def bench_feeder(bot, tracks, seconds):
+    output = bot.mumble.sound_output
+    output.realtime = False
+    for video in tracks[:int(seconds // TRACK_SECONDS) + 1]:
+        bot.queue.push(video)
+    start, cpu = time.perf_counter(), time.process_time()
+    play(bot, lambda: output.bytes >= seconds * BYTES_PER_SECOND)
+    audio = output.bytes / BYTES_PER_SECOND
+    bot.queue.clear(everyone=True)
+    return {'audio_seconds': audio, 'cpu_ms_per_audio_second': (time.process_time() - cpu) / audio * 1000,
+            'realtime_factor': audio / (time.perf_counter() - start)}
+
+
+def bench_switch(bot, config):
+    output = bot.mumble.sound_output
+    output.realtime = True
+    output.gaps, output.end = [], None
+    for number in range(4):
+        bot.queue.push(add_track(config, 1000 + number, 2))
+    play(bot, lambda: not bot.playing)
+    natural = list(output.gaps)
+
+    for number in range(4):
+        bot.queue.push(add_track(config, 2000 + number, 2))
+    skips = []
+    output.gaps, output.end = [], None
+    thread = threading.Thread(target=bot.loop, daemon=True)
+    bot.playnext()
+    thread.start()
+    for _ in range(3):
+        time.sleep(0.5)
+        output.added.clear()
+        start = time.perf_counter()
+        bot.cmd_skip()
+        output.added.wait()
+        skips.append(time.perf_counter() - start)
+    bot.exit = True
+    thread.join()
+    bot.exit = False
+    bot.stop()
+    bot.queue.clear(everyone=True)
+    return {'natural_gaps': len(natural), 'natural_gap_max_ms': max(natural, default=0) * 1000,
+            'skip': summary(skips)}
+
+
+def clear_memos():
+    """Forgets memoized parses, so every iteration pays for parsing like before they were memoized"""
+    utils.parse_parameter.cache_clear()
+    utils.canonical_youtube_url.cache_clear()
+
+
+def round_trip(bot, message):
+    """Sends message and waits until the command has run on its lane"""
+    lanes = (bot.commands.fast, bot.commands.slow)
+    clear_memos()
+    start = time.perf_counter()
+    bot.message_received(FakeText(1, message))
+    while any(lane.pending for lane in lanes):
+        time.sleep(0)
+    return time.perf_counter() - start
+
+
+def bench_commands(bot, video, iterations):
+    link = f'<a href="{video["url"]}">{video["url"]}</a>'
+    bot.playing = True
+    bot.current_track = video
+    results = {}
+    for name, message in (('yt', f'!yt {link}'), ('np', '!np'), ('queue', '!queue'), ('search', '!search synthetic')):
+        results[name] = summary([round_trip(bot, message) for _ in range(iterations)])
+        bot.queue.clear(everyone=True)
+    bot.current_track = None
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        utils.parse_parameter.__wrapped__(link)
+        samples.append(time.perf_counter() - start)
+    results['parse_parameter'] = summary(samples)
+    bot.playing = False
+    return results
+
+
+def bench_download(bot, iterations):
+    bot.playing = True
+    samples = []
+    for number in range(iterations):
+        queued = len(bot.queue)
+        start = time.perf_counter()
+        bot.message_received(FakeText(1, f'!yt https://youtu.be/dl{number:09d}'))
+        while len(bot.queue) == queued:
+            time.sleep(0.0005)
+        samples.append(time.perf_counter() - start)
+    bot.queue.clear(everyone=True)
+    bot.playing = False
+    return summary(samples)
+
+
+def bench_random(bot, picks):
+    start = time.perf_counter()
+    ShuffleBag(row.id for row in Video.select(Video.id).where(~Video.evicted))
+    build = time.perf_counter() - start
+    samples = []
+    for _ in range(picks):
+        start = time.perf_counter()
+        bot.pick_random()
+        samples.append(time.perf_counter() - start)
+    return {'library': Video.select().count(), 'shuffle_build_ms': build * 1000, 'pick': summary(samples)}
+
+
+def commit():
+    try:
+        return sp.run(['git', 'rev-parse', 'HEAD'], stdout=sp.PIPE, stderr=sp.DEVNULL, text=True,
+                      cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='file to write the JSON results to, default stdout')
+    parser.add_argument('--seconds', type=int, default=300, help='seconds of audio for the feeder benchmark')
+    parser.add_argument('--rows', type=int, default=100000, help='library size for the random pick benchmark')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = load_config(os.path.join(directory, 'config.ini'))
+        config.update({'loglevel': 'WARNING', 'filedir': os.path.join(directory, 'music'),
+                       'cachedir': os.path.join(directory, 'cache'),
+                       'state_file': os.path.join(directory, 'state.json'),
+                       'volume': 0.1, 'random': True, 'command_rate': 0, 'same_channel': False, 'ignore_private': False,
+                       'owner': OWNER, 'admins': [], 'ignored': [], 'blacklist': [], 'youtube_apikey': 'fake'})
+        os.makedirs(config['cachedir'])
+        os.makedirs(config['filedir'])
+        init_db(os.path.join(directory, 'musabot.db'))
+        fill_library(args.rows, config['filedir'])
+        tracks = [add_track(config, number) for number in range(args.seconds // TRACK_SECONDS + 1)]
+
+        mumble = FakeMumble()
+        mumble.add_user(1, 'benchmark', OWNER)
+        bot = BenchBot(config, mumble, FakeYouTube())
+        bot.load_library()
+        bot.config['random'] = False
+        results = {
+            'feeder': bench_feeder(bot, tracks, args.seconds),
+            'switch': bench_switch(bot, config),
+            'commands': bench_commands(bot, tracks[0], args.iterations),
+            'download_stub': bench_download(bot, min(args.iterations, 50)),
+        }
+        bot.config['random'] = True
+        results['random'] = bench_random(bot, args.iterations * 10)
+        bot.downloads.shutdown()
+
+    report = {'commit': commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+              'timestamp': time.time(), 'arguments': vars(args), 'results': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
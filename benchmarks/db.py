@@ -0,0 +1,76 @@
+"""Per command database latency with a connection per query versus the persistent tuned connection
+
+Runs the lookup !yt/!mp3 does for every request and the insert done at the end of every download against a
+temporary library, once the way the bot used to (connect, query, close, default pragmas) and once with the
+persistent WAL connection and the batching writer.
+
+    python benchmarks/db.py [library size]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot.models import db, Video, init_db  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.dbwriter import DbWriter  # noqa: E402 pylint: disable=wrong-import-position
+
+LOOKUPS = 2000
+INSERTS = 500
+
+
+def fill(size):
+    with db.atomic():
+        Video.insert_many([{'id': f'{i:064x}', 'url': f'https://youtu.be/{i}', 'title': f'Track {i}'}
+                           for i in range(size)]).execute()
+
+
+def per_query(size):
+    db.close()
+    db.init(db.database)
+    ids = [f'{i * 7919 % size:064x}' for i in range(LOOKUPS)]
+    start = time.perf_counter()
+    for videoid in ids:
+        db.connect()
+        Video.get_by_id(videoid)
+        db.close()
+    lookup = (time.perf_counter() - start) / LOOKUPS
+    start = time.perf_counter()
+    for i in range(INSERTS):
+        db.connect()
+        Video.create(id=f'old{i}', url='u', title='t')
+        db.close()
+    insert = (time.perf_counter() - start) / INSERTS
+    return lookup, insert
+
+
+def persistent(size):
+    init_db(db.database)
+    ids = [f'{i * 7919 % size:064x}' for i in range(LOOKUPS)]
+    start = time.perf_counter()
+    for videoid in ids:
+        Video.get_by_id(videoid)
+    lookup = (time.perf_counter() - start) / LOOKUPS
+    writer = DbWriter(db)
+    start = time.perf_counter()
+    wait([writer.submit(Video.create, id=f'new{i}', url='u', title='t') for i in range(INSERTS)])
+    insert = (time.perf_counter() - start) / INSERTS
+    return lookup, insert
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as directory:
+        init_db(os.path.join(directory, 'bench.db'))
+        fill(size)
+        db.execute_sql('PRAGMA journal_mode=delete')
+        for name, func in (('connect per query', per_query), ('persistent + writer', persistent)):
+            lookup, insert = func(size)
+            print(f'{name:20} lookup {lookup * 1e6:8.1f} us  insert {insert * 1e6:8.1f} us')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Stand-ins for the pymumble client and the YouTube API client, so the bot can run without a server or network"""
+import threading
+import time
+
+from musabot.player import BYTES_PER_SECOND
+
+
+class FakeUser(dict):
+    def __init__(self, session, name, userhash, channel_id=0):
+        super().__init__(session=session, name=name, hash=userhash, channel_id=channel_id)
+        self.messages = []
+
+    def send_text_message(self, msg):
+        self.messages.append(msg)
+
+    def comment(self, comment):
+        self['comment'] = comment
+
+    def move_in(self, channel_id):
+        self['channel_id'] = channel_id
+
+
+class FakeUsers(dict):
+    def __init__(self):
+        super().__init__()
+        self.myself = FakeUser(0, 'musabot', '')
+        self[0] = self.myself
+
+
+class FakeChannel(dict):
+    def __init__(self, channel_id, name):
+        super().__init__(channel_id=channel_id, name=name)
+        self.messages = []
+
+    def send_text_message(self, msg):
+        self.messages.append(msg)
+
+
+class FakeSoundOutput:
+    """Plays audio back in real time like pymumble's sound output, or instantly with realtime=False
+
+    Records every stretch of time the buffer sat empty between two add_sound calls.
+    """
+
+    def __init__(self, realtime=True, clock=time.monotonic):
+        self.realtime = realtime
+        self.clock = clock
+        self.end = None
+        self.bytes = 0
+        self.gaps = []
+        self.added = threading.Event()
+        self.lock = threading.Lock()
+
+    def get_buffer_size(self):
+        if not self.realtime or self.end is None:
+            return 0.0
+        return max(0.0, self.end - self.clock())
+
+    def add_sound(self, pcm):
+        with self.lock:
+            now = self.clock()
+            if self.end is not None and self.realtime and now > self.end:
+                self.gaps.append(now - self.end)
+            self.end = max(now, self.end or now) + len(pcm) / BYTES_PER_SECOND
+            self.bytes += len(pcm)
+        self.added.set()
+
+    def clear_buffer(self):
+        with self.lock:
+            self.end = None
+
+
+class FakeCallbacks:
+    def __init__(self):
+        self.callbacks = {}
+
+    def set_callback(self, name, callback):
+        self.callbacks[name] = callback
+
+
+class FakeMumble:
+    def __init__(self, realtime=True):
+        self.users = FakeUsers()
+        self.channels = {0: FakeChannel(0, 'Root')}
+        self.sound_output = FakeSoundOutput(realtime)
+        self.callbacks = FakeCallbacks()
+        self.alive = True
+
+    def add_user(self, session, name, userhash):
+        self.users[session] = FakeUser(session, name, userhash)
+        return self.users[session]
+
+    def is_alive(self):
+        return self.alive
+
+    def set_codec_profile(self, profile):
+        pass
+
+    def start(self):
+        pass
+
+    def is_ready(self):
+        pass
+
+    def set_bandwidth(self, bandwidth):
+        pass
+
+
+class FakeText:
+    """A received text message"""
+
+    def __init__(self, actor, message):
+        self.actor = actor
+        self.message = message
+        self.session = []
+
+
+class FakeYouTube:
+    """Answers videos().list() for any id with a three minute video"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def videos(self):
+        return self
+
+    def list(self, part, id, maxResults):  # noqa: A002 pylint: disable=redefined-builtin,invalid-name,unused-argument
+        self.requests += 1
+        self.ids = id.split(',')
+        return self
+
+    def execute(self):
+        time.sleep(self.latency)
+        return {'items': [{'id': videoid, 'snippet': {'title': f'Synthetic {videoid}'},
+                           'contentDetails': {'duration': 'PT3M'}} for videoid in self.ids]}
@@ -0,0 +1,108 @@
+"""Compares the CPU cost of the old feed loop with the current one, per stream and second of audio
+
+The old loop polled get_buffer_size() every 10 ms while more than 0.5 s were buffered and then fed 480 bytes with
+audioop. The current one sleeps with the Pacer until the buffer is expected to have drained to its target and feeds
+40 ms blocks with numpy. Both read synthetic PCM from a pipe, like the ffmpeg decoder is read, and feed a fake output
+that plays back in real time, so a run takes as long as the audio. Reported is the CPU time of the whole process per
+second of audio, the number of wake ups and the gaps where the output ran empty.
+
+    python benchmarks/feeder.py [seconds of audio]
+"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot import feeder  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.player import SAMPLE_RATE, BYTES_PER_SECOND  # noqa: E402 pylint: disable=wrong-import-position
+from fakes import FakeSoundOutput  # noqa: E402 pylint: disable=wrong-import-position
+
+VOLUME = 0.3
+
+
+def synthetic_pcm(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 440 * t) * 16000).astype('<i2').tobytes()
+
+
+def pipe_reader(data):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, 'wb') as pipe:
+            pipe.write(data)
+
+    threading.Thread(target=write, daemon=True).start()
+    return os.fdopen(read_fd, 'rb')
+
+
+def old_loop(pipe, output, gain):
+    """The loop as it was before blocks and pacing, returns the number of wake ups"""
+    wakeups = 0
+    while True:
+        while output.get_buffer_size() > 0.5:
+            time.sleep(0.01)
+            wakeups += 1
+        chunk = pipe.read(480)
+        wakeups += 1
+        if not chunk:
+            return wakeups
+        output.add_sound(gain(chunk))
+
+
+def new_loop(pipe, output, gain):
+    pacer = feeder.Pacer()
+    wakeups = 0
+    while True:
+        pacer.wait(output.get_buffer_size())
+        block = pipe.read(feeder.BLOCK_SIZE)
+        wakeups += 1
+        if not block:
+            return wakeups
+        output.add_sound(gain(block))
+
+
+def audioop_gain():
+    try:
+        import audioop  # pylint: disable=import-outside-toplevel,deprecated-module
+    except ImportError:
+        return None
+    return lambda chunk: audioop.mul(chunk, 2, VOLUME)
+
+
+def numpy_gain(block):
+    return feeder.apply_gain(block, VOLUME)
+
+
+def measure(loop, gain, data):
+    output = FakeSoundOutput()
+    seconds = len(data) / BYTES_PER_SECOND
+    with pipe_reader(data) as pipe:
+        start = time.process_time()
+        wakeups = loop(pipe, output, gain)
+        cpu = time.process_time() - start
+    return cpu / seconds, wakeups / seconds, output.gaps
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    data = synthetic_pcm(seconds)
+    print(f'{seconds:.0f} s of audio per loop, played in real time')
+    variants = [('old loop, numpy gain', old_loop, numpy_gain), ('pacer, numpy blocks', new_loop, numpy_gain)]
+    gain = audioop_gain()
+    if gain is None:
+        print('audioop not available, the old loop uses numpy on its 480 byte chunks')
+    else:
+        variants.insert(0, ('old loop, audioop', old_loop, gain))
+    for name, loop, gain in variants:
+        cpu, wakeups, gaps = measure(loop, gain, data)
+        print(f'{name:22} {cpu * 1000:6.2f} ms CPU per second of audio, {wakeups:6.0f} wake ups/s, '
+              f'{len(gaps)} gaps, longest {max(gaps, default=0) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
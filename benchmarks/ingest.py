@@ -0,0 +1,73 @@
+"""Compares ingest CPU time and disk size of transcoding downloads to mp3 with keeping the source audio stream
+
+A synthetic track is encoded to Opus in WebM and to AAC in MP4, the formats YouTube serves as bestaudio. Each is then
+ingested both ways (store, loudness analysis) and decoded once the way a play does. CPU time is the user + system
+time of the ffmpeg children.
+
+    python benchmarks/ingest.py [seconds of audio]
+"""
+import os
+import resource
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot import loudness  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.player import ffmpeg_command  # noqa: E402 pylint: disable=wrong-import-position
+
+SOURCES = {
+    'opus/webm': ['-codec:a', 'libopus', '-b:a', '128k', '-f', 'webm'],
+    'aac/mp4': ['-codec:a', 'aac', '-b:a', '128k', '-f', 'mp4'],
+}
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def ffmpeg(*args):
+    sp.run(['ffmpeg', '-v', 'error', '-nostdin', '-y', *args], check=True)
+
+
+def synthetic(path, seconds, codec):
+    """A chord with some noise, so the encoders have something to work on"""
+    ffmpeg('-f', 'lavfi', '-i', f'sine=frequency=220:duration={seconds}',
+           '-f', 'lavfi', '-i', f'sine=frequency=277:duration={seconds}',
+           '-f', 'lavfi', '-i', f'anoisesrc=amplitude=0.05:duration={seconds}',
+           '-filter_complex', 'amix=inputs=3', '-ac', '2', '-ar', '48000', *codec, path)
+
+
+def measure(source, directory, mode):
+    stored = os.path.join(directory, f'stored-{mode}')
+    start = children_cpu()
+    if mode == 'mp3':
+        ffmpeg('-i', source, '-vn', '-codec:a', 'libmp3lame', '-q:a', '2', '-f', 'mp3', stored)
+    else:
+        shutil.copyfile(source, stored)
+    loudness.analyze(stored)
+    ingest = children_cpu() - start
+    start = children_cpu()
+    sp.run(ffmpeg_command(stored, filters='volume=0dB', output='-'), stdout=sp.DEVNULL, check=True)
+    decode = children_cpu() - start
+    return ingest, decode, os.path.getsize(stored)
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 240
+    print(f'{seconds} s track')
+    print(f"{'source':<10} {'mode':<7} {'ingest cpu':>11} {'play cpu':>9} {'size':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, codec in SOURCES.items():
+            source = os.path.join(directory, 'source')
+            synthetic(source, seconds, codec)
+            for mode in ('mp3', 'source'):
+                ingest, decode, size = measure(source, directory, mode)
+                print(f'{name:<10} {mode:<7} {ingest:>10.2f}s {decode:>8.2f}s {size / 1024:>7.0f}kB')
+
+
+if __name__ == '__main__':
+    main()
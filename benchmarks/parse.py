@@ -0,0 +1,75 @@
+"""Per message link parsing cost and import times
+
+Compares building a BeautifulSoup tree for every !yt/!mp3 parameter, like the bot used to, with the regular
+expression fast path, with and without the memo. Import times are the median wall time of a fresh interpreter
+importing the module, minus that of an empty interpreter.
+
+    python benchmarks/parse.py [iterations]
+"""
+import os
+import statistics
+import subprocess as sp
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot import utils  # noqa: E402 pylint: disable=wrong-import-position
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+MESSAGE = ('<a href="https://www.youtube.com/watch?v=dQw4w9WgXcQ&amp;t=42s">'
+           'https://www.youtube.com/watch?v=dQw4w9WgXcQ&amp;t=42s</a>')
+MODULES = ('bs4', 'googleapiclient.discovery', 'peewee', 'musabot.utils', 'musabot.bot')
+
+
+def soup_parse_parameter(parameter):
+    soup = BeautifulSoup(parameter, "html.parser")
+    try:
+        url = soup.find('a').get('href')
+    except AttributeError:
+        url = parameter
+    return url, utils.hash_url(url)
+
+
+def per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(MESSAGE)
+    return (time.perf_counter() - start) / iterations
+
+
+def import_time(module, runs=7):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = sp.run([sys.executable, '-c', f'import {module}' if module else 'pass'], cwd=ROOT,
+                        stdout=sp.DEVNULL, stderr=sp.DEVNULL, check=False)
+        samples.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None
+    return statistics.median(samples)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    assert soup_parse_parameter(MESSAGE) == utils.parse_parameter(MESSAGE)
+    print('parse_parameter per message')
+    for name, func in (('BeautifulSoup', soup_parse_parameter),
+                       ('fast path', utils.parse_parameter.__wrapped__),
+                       ('fast path, memoized', utils.parse_parameter)):
+        print(f'  {name:<20} {per_call(func, iterations) * 1e6:8.2f} us')
+
+    baseline = import_time(None)
+    print('import time')
+    for module in MODULES:
+        elapsed = import_time(module)
+        if elapsed is None:
+            print(f'  {module:<26} not importable here')
+        else:
+            print(f'  {module:<26} {(elapsed - baseline) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
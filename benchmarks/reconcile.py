@@ -0,0 +1,83 @@
+"""Startup reconciliation of the file directory against the library
+
+Builds a library of --rows tracks with a file each and times Reconciler.run() when nothing changed, when --changed
+files have to be probed again, with one and with the default number of probe workers, and when --changed files are
+missing and as many files have no row. ffprobe is replaced by a stand-in taking --probe-ms per file.
+
+    python benchmarks/reconcile.py [--rows 50000] [--changed 1000] [--probe-ms 30]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot.dbwriter import DbWriter  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.models import db, Video, init_db  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.reconcile import Reconciler, PROBE_WORKERS  # noqa: E402 pylint: disable=wrong-import-position
+from bot import fill_library  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def fake_probe(seconds):
+    def probe(_file, timeout=None):  # pylint: disable=unused-argument
+        time.sleep(seconds)
+        return {'container': 'webm', 'codec': 'opus', 'duration': None, 'video_stream': False}
+    return probe
+
+
+def run(directory, args, workers, damage):
+    """Times one reconciliation of a fresh library after damage(filedir, ids) changed it"""
+    filedir = os.path.join(directory, f'music-{time.monotonic_ns()}')
+    os.makedirs(filedir)
+    if not db.is_closed():
+        db.close()
+    init_db(f'{filedir}.db')
+    fill_library(args.rows, filedir)
+    damage(filedir, [f'{i:064x}' for i in range(args.changed)])
+    dbwriter = DbWriter(db)
+    reconciler = Reconciler(filedir, dbwriter, lambda _: None, lambda _: None, workers,
+                            fake_probe(args.probe_ms / 1000))
+    reconciler.started = time.time() + 1
+    start = time.perf_counter()
+    counts = reconciler.run()
+    dbwriter.submit(lambda: None).result()
+    return time.perf_counter() - start, counts
+
+
+def unchanged(_filedir, _ids):
+    pass
+
+
+def touched(_filedir, ids):
+    Video.update(file_mtime=None).where(Video.id.in_(ids)).execute()
+
+
+def missing_and_orphaned(filedir, ids):
+    for videoid in ids:
+        os.remove(os.path.join(filedir, videoid))
+        with open(os.path.join(filedir, f'orphan-{videoid}'), 'wb'):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--changed', type=int, default=1000)
+    parser.add_argument('--probe-ms', type=float, default=30)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, workers, damage in (('unchanged', PROBE_WORKERS, unchanged),
+                                      (f'{args.changed} changed, 1 worker', 1, touched),
+                                      (f'{args.changed} changed, {PROBE_WORKERS} workers', PROBE_WORKERS, touched),
+                                      (f'{args.changed} missing and orphaned', PROBE_WORKERS, missing_and_orphaned)):
+            elapsed, counts = run(directory, args, workers, damage)
+            print(f'{name:<32} {elapsed * 1000:9.1f} ms  {dict(sorted(counts.items()))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Memory and CPU cost of every extra session sharing one library, download pool and decoded audio cache
+
+Starts 1 to --sessions sessions against fake Mumble servers, plays --seconds of synthetic audio in real time on all
+of them at once and reports resident memory and CPU per second of audio.
+
+    python benchmarks/sessions.py [--sessions 4] [--seconds 20]
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from configobj import ConfigObj
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from musabot.bot import Musabot, Shared, load_config  # noqa: E402 pylint: disable=wrong-import-position
+from musabot.models import init_db  # noqa: E402 pylint: disable=wrong-import-position
+from bot import add_track, fill_library  # noqa: E402 pylint: disable=wrong-import-position
+from fakes import FakeMumble, FakeYouTube  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def rss_mb():
+    with open('/proc/self/statm', encoding='ascii') as file:
+        return int(file.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def play_all(sessions, tracks, seconds):
+    """Plays on every session at once for seconds, returns the CPU seconds used"""
+    for session in sessions:
+        for video in tracks:
+            session.queue.push(video)
+        session.playnext()
+    threads = [threading.Thread(target=session.loop, daemon=True) for session in sessions]
+    cpu = time.process_time()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    for session in sessions:
+        session.exit = True
+    for thread in threads:
+        thread.join()
+    used = time.process_time() - cpu
+    for session in sessions:
+        session.exit = False
+        session.stop()
+        session.queue.clear(everyone=True)
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--seconds', type=int, default=20, help='seconds of audio to play on every session')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = load_config(os.path.join(directory, 'config.ini'))
+        config.update({'loglevel': 'WARNING', 'filedir': os.path.join(directory, 'music'),
+                       'cachedir': os.path.join(directory, 'cache'), 'volume': 0.1, 'random': False,
+                       'owner': '', 'admins': [], 'ignored': [], 'blacklist': [], 'youtube_apikey': 'fake'})
+        os.makedirs(config['cachedir'])
+        os.makedirs(config['filedir'])
+        init_db(os.path.join(directory, 'musabot.db'))
+        fill_library(10000, config['filedir'])
+        tracks = [add_track(config, number, args.seconds) for number in range(2)]
+
+        shared = Shared(config, FakeYouTube())
+        sessions = []
+        print(f'{"sessions":>8} {"rss MB":>8} {"+MB":>6} {"cpu ms/s of audio":>18}')
+        before = rss_mb()
+        for count in range(1, args.sessions + 1):
+            session_config = ConfigObj(config.dict())
+            session_config['state_file'] = os.path.join(directory, f'state-{count}.json')
+            session = Musabot(session_config, FakeMumble(), shared=shared)
+            session.load_library()
+            sessions.append(session)
+            cpu = play_all(sessions, tracks, args.seconds)
+            rss = rss_mb()
+            print(f'{count:>8} {rss:8.1f} {rss - before:6.1f} {cpu / (args.seconds * count) * 1000:18.2f}')
+            before = rss
+        shared.downloads.shutdown()
+
+
+if __name__ == '__main__':
+    main()
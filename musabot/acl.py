@@ -0,0 +1,56 @@
+import logging
+
+USER = 0
+ADMIN = 1
+OWNER = 2
+
+
+class Acl:
+    """Hash sets of the admin, ignore and blacklist config lists
+
+    Lookups don't touch the config, changes update the set and the config list together and schedule a config write.
+    """
+
+    LISTS = ('admins', 'ignored', 'blacklist')
+
+    def __init__(self, config, writer):
+        self.config = config
+        self.writer = writer
+        self.owner = config['owner']
+        self.sets = {name: set(config.as_list(name)) for name in self.LISTS}
+
+    def is_admin(self, user):
+        if user['hash'] == self.owner:
+            logging.debug("%s(%s) authenticated as owner", user['name'], user['hash'])
+            return OWNER
+        if user['hash'] in self.sets['admins']:
+            logging.debug("%s(%s) authenticated as admin", user['name'], user['hash'])
+            return ADMIN
+        logging.debug("Failed to authenticate %s(%s)", user['name'], user['hash'])
+        return USER
+
+    def is_ignored(self, user):
+        return user['hash'] in self.sets['ignored']
+
+    def is_blacklisted(self, urlhash):
+        return urlhash in self.sets['blacklist']
+
+    def add(self, name, value):
+        """Adds value to the named list, returns False if it was already there"""
+        if value in self.sets[name]:
+            return False
+        self.sets[name].add(value)
+        self._store(name)
+        return True
+
+    def remove(self, name, value):
+        """Removes value from the named list, returns False if it wasn't there"""
+        if value not in self.sets[name]:
+            return False
+        self.sets[name].discard(value)
+        self._store(name)
+        return True
+
+    def _store(self, name):
+        self.config[name] = sorted(self.sets[name])
+        self.writer.schedule()
@@ -0,0 +1,1212 @@
+import time
+import subprocess as sp
+import os
+import re
+import logging
+import threading
+from functools import partial
+
+from configobj import ConfigObj
+
+from peewee import IntegrityError
+
+import requests
+
+import pymumble_py3 as pymumble
+from pymumble_py3.errors import UnknownChannelError
+
+from musabot import utils, loudness, feeder, dsp, metrics
+from musabot.downloads import DownloadPool, DownloadError
+from musabot.pcmcache import PcmCache
+from musabot.player import FfmpegSource, StreamSource, PcmSource, SAMPLE_RATE, probe
+from musabot.models import db, Video, search
+from musabot.shuffle import ShuffleBag
+from musabot.dbwriter import DbWriter
+from musabot.acl import Acl, OWNER, USER
+from musabot.configwriter import ConfigWriter
+from musabot.youtube import YouTubeMetadata, VideoUnavailable, MAX_BATCH
+from musabot.imports import ImportRegistry, resolve_in_batches
+from musabot.evictor import Evictor, CacheStats
+from musabot.reconcile import Reconciler
+from musabot.fairqueue import FairQueue
+from musabot.state import StateFile
+from musabot.commands import CommandExecutor, RateLimiter
+
+
+def load_config(path='config.ini'):
+    """Reads the config and fills in defaults for options added over time"""
+    config = ConfigObj(path)
+    config.setdefault('download_workers', 2)
+    config.setdefault('cachedir', 'cache')
+    config.setdefault('cache_budget', 2048)
+    config.setdefault('prefetch', 10)
+    config.setdefault('crossfade', 0)
+    config.setdefault('eq', 'flat')
+    config.setdefault('limiter', True)
+    config.setdefault('youtube_cache_ttl', 7 * 24 * 3600)
+    config.setdefault('youtube_negative_ttl', 24 * 3600)
+    config.setdefault('playlist_limit', 200)
+    config.setdefault('filedir_budget', 0)
+    config.setdefault('progressive', True)
+    config.setdefault('ingest_format', 'source')
+    config.setdefault('state_file', 'state.json')
+    config.setdefault('metrics_port', 0)
+    config.setdefault('download_timeout', 900)
+    config.setdefault('command_rate', 0.5)
+    config.setdefault('command_burst', 5)
+    return config
+
+
+# How often the playback position is saved while playing, in seconds
+POSITION_SAVE_INTERVAL = 10
+
+PROGRESS_RE = re.compile(r'\[download\]\s+([\d.]+)%')
+
+
+def track_progress(job, stream):
+    """Parses yt-dlp progress lines into the job"""
+    for line in stream:
+        match = PROGRESS_RE.match(line.decode('utf-8', 'replace'))
+        if match:
+            job.progress = float(match.group(1))
+
+
+def connect_youtube(apikey):
+    from googleapiclient.discovery import build  # pylint: disable=import-outside-toplevel
+    return build('youtube', 'v3', developerKey=apikey, cache_discovery=False)
+
+
+class Shared:
+    """What all sessions in a process use together: the library, the download pool, the caches and the ACL"""
+
+    def __init__(self, config, youtube=None):
+        self.filedir = config['filedir']
+        if not os.path.exists(self.filedir):
+            logging.info("File directory does not exist, creating")
+            os.makedirs(self.filedir)
+        self.config_writer = ConfigWriter(config)
+        self.acl = Acl(config, self.config_writer)
+        self.downloads = DownloadPool(config.as_int('download_workers'),
+                                      timeout=config.as_int('download_timeout') or None)
+        self.imports = ImportRegistry()
+        self.pcmcache = PcmCache(config['cachedir'], config.as_int('cache_budget') * 1024 * 1024)
+        self.dbwriter = DbWriter(db)
+        self.shuffle = ShuffleBag()
+        self.cachestats = CacheStats()
+        self.sessions = []
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.evictor = Evictor(self.filedir, config.as_int('filedir_budget') * 1024 * 1024, self.protected_tracks,
+                               self.evicted, self.cachestats)
+        self.reconciler = Reconciler(self.filedir, self.dbwriter, self.evicted, self.shuffle.add)
+
+        if youtube is not None or config['youtube_apikey']:
+            if youtube is None:
+                connect = partial(connect_youtube, config['youtube_apikey'])
+            else:
+                def connect():
+                    return youtube
+            self.ytmeta = YouTubeMetadata(connect, self.dbwriter, config.as_int('youtube_cache_ttl'),
+                                          config.as_int('youtube_negative_ttl'))
+        else:
+            logging.warning('YouTube API Key not set')
+            self.ytmeta = None
+
+    def add(self, session):
+        with self.lock:
+            self.sessions.append(session)
+
+    def release(self, session):
+        """Called when a session ends, the download pool is shut down when the last one does"""
+        with self.lock:
+            self.sessions.remove(session)
+            if self.sessions:
+                return
+        self.downloads.shutdown()
+
+    def load_library(self):
+        """Reads the library into the shuffle bag and starts checking it against the files, once however many sessions
+        call it"""
+        with self.lock:
+            if not self.loaded:
+                self.shuffle.extend(row.id for row in Video.select(Video.id).where(~Video.evicted))
+                self.reconciler.start()
+                self.loaded = True
+
+    def protected_tracks(self):
+        protected = set()
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            protected |= session.protected_tracks()
+        return protected
+
+    def evicted(self, videoid):
+        self.pcmcache.remove(videoid)
+        self.shuffle.remove(videoid)
+        self.dbwriter.submit(Video.update(evicted=True).where(Video.id == videoid).execute)
+
+
+class Musabot:
+    """The bot, connected to a Mumble server by run()
+
+    mumble and youtube default to a pymumble client and a YouTube API client built from config. Anything with the
+    same interface can be passed instead, the benchmarks use that to run the bot without a server or network.
+
+    Nothing in the constructor touches the database, load_library() reads the library once the database is set up,
+    which can happen while connect() is still talking to the server.
+
+    Sessions given the same shared run side by side in one process, see musabot.supervisor. Settings changed with
+    commands like !vol and !set are saved to the settings section, config itself if not given.
+    """
+
+    def __init__(self, config, mumble=None, youtube=None, shared=None, settings=None):
+        self.config = config
+        self.settings = config if settings is None else settings
+        self.shared = shared or Shared(config, youtube)
+        self.shared.add(self)
+        self.filedir = self.shared.filedir
+        self.config_writer = self.shared.config_writer
+        self.acl = self.shared.acl
+        self.downloads = self.shared.downloads
+        self.imports = self.shared.imports
+        self.pcmcache = self.shared.pcmcache
+        self.dbwriter = self.shared.dbwriter
+        self.shuffle = self.shared.shuffle
+        self.cachestats = self.shared.cachestats
+        self.evictor = self.shared.evictor
+        self.ytmeta = self.shared.ytmeta
+        self.volume = self.config.as_float('volume')
+        self.dsp = dsp.Chain(self.volume, self.config['eq'], self.config.as_bool('limiter'))
+
+        self.playing = False
+        self.paused = False
+        self.exit = False
+        self.source = None
+        self.prefetched = None
+
+        self.search_results = {}
+        self.current_track = None
+        self.state = StateFile(self.config['state_file'])
+        self.queue = FairQueue(self.state.schedule)
+        self.state.register('queue', self.queue.dump)
+        self.state.register('position', self.saved_position)
+        self.lock = threading.RLock()
+        self.commands = CommandExecutor()
+        self.ratelimit = RateLimiter(self.config.as_float('command_rate'), self.config.as_int('command_burst'))
+
+        if mumble is None:
+            mumble = pymumble.Mumble(self.config['host'], self.config['user'], port=self.config.as_int('port'),
+                                     password=self.config['password'], certfile=self.config['cert'],
+                                     keyfile=self.config['privkey'], reconnect=True)
+        self.mumble = mumble
+
+    def connect(self):
+        """Starts connecting to the server in the background"""
+        self.mumble.callbacks.set_callback("text_received", self.message_received)
+        self.mumble.set_codec_profile("audio")
+        self.mumble.start()
+
+    def load_library(self):
+        self.shared.load_library()
+        with self.lock:
+            self.restore_queue()
+
+    def run(self):
+        """Waits for the connection started by connect() and feeds audio until the bot is killed"""
+        self.mumble.is_ready()
+        self.mumble.set_bandwidth(200000)
+        if self.config.get('channel'):
+            try:
+                self.mumble.channels.find_by_name(self.config['channel']).move_in()
+            except UnknownChannelError:
+                logging.warning("Channel %s not found", self.config['channel'])
+        self.resume_saved()
+        self.loop()
+
+    def message_received(self, text):
+        message = text.message.strip()
+        logging.debug("<%s> %s", text.actor, message)
+
+        if message.startswith('!'):
+            self.handle_command(text, message)
+
+    def launch_play_file(self, video, source=None):
+        self.stop()
+        self.track_started()
+        self.source = source or self.open_source(video)
+        self.playing = True
+
+    def track_started(self):
+        self.track_comment()
+        self.dbwriter.submit(Video.update(play_count=Video.play_count + 1, last_played=time.time())
+                             .where(Video.id == self.current_track['id']).execute)
+
+    def track_comment(self):
+        self.mumble.users.myself.comment(f"Now playing:<br>{self.current_track['title']}<br>"
+                                         f"<a href=\"{self.current_track['url']}\">{self.current_track['url']}</a>")
+
+    def open_source(self, video):
+        file = os.path.join(self.filedir, video['id'])
+        source = self.pcmcache.open(video['id'], video.get('starttime'))
+        if source is None:
+            logging.debug("Track not in PCM cache, decoding with ffmpeg")
+            source = FfmpegSource(file, video.get('starttime'), loudness.audio_filter(video), video.get('duration'))
+            self.pcmcache.ingest_async(file, video['id'], loudness.audio_filter(video))
+        return source
+
+    def prefetch(self):
+        """Opens the track that plays next, so that it is ready when the current one ends"""
+        if self.queue:
+            video, from_queue = self.queue.peek(), True
+        elif self.config.as_bool('random'):
+            videos = self.pick_random()
+            if not videos:
+                return
+            video, from_queue = videos[0], False
+        else:
+            return
+        logging.debug("Prefetching %s", video['id'])
+        self.prefetched = (video, self.open_source(video), from_queue)
+
+    def prefetch_valid(self):
+        video, _, from_queue = self.prefetched
+        if from_queue:
+            return self.queue.peek() is video
+        return not self.queue and self.config.as_bool('random')
+
+    def discard_prefetch(self):
+        if self.prefetched is not None:
+            video, source, from_queue = self.prefetched
+            source.close()
+            if not from_queue:
+                self.shuffle.add(video['id'])
+            self.prefetched = None
+
+    def take_prefetch(self):
+        """Returns the prefetched track and its source if it is still the one that should play next"""
+        if self.prefetched is None:
+            return None
+        if not self.prefetch_valid():
+            self.discard_prefetch()
+            return None
+        video, source, from_queue = self.prefetched
+        self.prefetched = None
+        if from_queue:
+            self.queue.pop()
+        return video, source
+
+    def handover(self):
+        """Switches to the prefetched track without stopping playback"""
+        prefetched = self.take_prefetch()
+        if prefetched is None:
+            return False
+        self.source.close()
+        self.current_track, self.source = prefetched
+        logging.debug("Handed over to %s", self.current_track['id'])
+        self.track_started()
+        return True
+
+    def read_audio(self, size):
+        if self.prefetched is not None and not self.prefetch_valid():
+            self.discard_prefetch()
+        remaining = self.source.remaining
+        crossfade = self.config.as_float('crossfade')
+        lead = max(self.config.as_float('prefetch'), crossfade)
+        if self.prefetched is None and (remaining is None or remaining <= lead):
+            self.prefetch()
+
+        if self.prefetched is not None and remaining is not None and remaining < crossfade:
+            return self.read_crossfade(size, remaining / crossfade,
+                                       max(0.0, remaining - feeder.BLOCK_DURATION) / crossfade)
+
+        data = self.source.read(size)
+        if len(data) < size and self.handover():
+            data += self.source.read(size - len(data))
+        return data
+
+    def read_crossfade(self, size, start, end):
+        """Mixes the end of the current track with the start of the prefetched one, fading between the levels"""
+        current = self.source.read(size)
+        data = feeder.crossfade(current, self.prefetched[1].read(size), start, end)
+        if len(current) < size:
+            self.handover()
+        return data
+
+    def loop(self):
+        pacer = feeder.Pacer()
+        fed = None
+        saved = time.monotonic()
+        while not self.exit and self.mumble.is_alive():
+            if self.playing and not self.paused:
+                buffered = self.mumble.sound_output.get_buffer_size()
+                if buffered == 0 and fed is self.source:
+                    metrics.UNDERRUNS.inc()
+                metrics.FEED_LATENESS.observe(pacer.wait(buffered))
+                with self.lock:
+                    if not self.playing:
+                        continue
+                    raw_music = self.read_audio(feeder.BLOCK_SIZE)
+                if raw_music:
+                    self.mumble.sound_output.add_sound(self.dsp.process(raw_music))
+                    fed = self.source
+                else:
+                    self.playnext()
+                if time.monotonic() - saved > POSITION_SAVE_INTERVAL:
+                    saved = time.monotonic()
+                    self.state.schedule()
+            else:
+                fed = None
+                time.sleep(0.1)
+
+        while self.mumble.sound_output.get_buffer_size() > 0:
+            time.sleep(0.01)
+        time.sleep(0.5)
+
+    def stop(self):
+        # The feed loop only reads the source while holding the lock, so it can be closed right away
+        with self.lock:
+            self.mumble.users.myself.comment('Stopped')
+            self.discard_prefetch()
+            self.paused = False
+            if self.source:
+                self.playing = False
+                self.source.close()
+                self.source = None
+                self.current_track = None
+
+    def send_msg(self, target, msg):
+        logging.debug("<musabot> -> <%s> %s", target, msg)
+        self.mumble.users[target].send_text_message(msg)
+
+    def send_msg_channel(self, msg, channel=None):
+        if not channel:
+            try:
+                channel = self.mumble.channels[self.mumble.users.myself['channel_id']]
+            except KeyError:
+                channel = self.mumble.channels[0]
+        logging.debug("%s <musabot> %s", channel, msg)
+        channel.send_text_message(msg)
+
+    def playnext(self):
+        with self.lock:
+            prefetched = self.take_prefetch()
+            self.stop()
+            if prefetched is not None:
+                logging.debug("Playing prefetched track")
+                self.current_track = prefetched[0]
+                self.launch_play_file(*prefetched)
+            elif self.queue:
+                logging.debug("Playing track from queue")
+                self.current_track = self.queue.pop()
+                self.launch_play_file(self.current_track)
+            elif self.config.as_bool('random'):
+                logging.debug("Playing random track")
+                self.random()
+            else:
+                logging.debug("Playback stopped")
+                self.playing = False
+                self.state.schedule()
+
+    def handle_command(self, text, message):
+        if self.acl.is_ignored(self.mumble.users[text.actor]):
+            self.send_msg(text.actor, 'You are on my ignore list')
+            return
+
+        if self.acl.is_admin(self.mumble.users[text.actor]) == USER:
+            if self.config.as_bool('same_channel') and self.mumble.users.myself['channel_id'] !=\
+                    self.mumble.users[text.actor]['channel_id']:
+                self.send_msg(text.actor, 'You need to be on the same channel!')
+            elif self.config.as_bool('ignore_private') and text.session:
+                if text.session[0] == self.mumble.users.myself['session']:
+                    self.send_msg(text.actor, "It's rude to whisper in a group")
+            return
+
+        command, parameter = utils.parse_command(message)
+
+        if command in ['yt', 'y']:
+            handler = self.cmd_youtube
+        elif command in ['vol', 'v']:
+            handler = self.cmd_volume
+        else:
+            handler = getattr(self, 'cmd_' + command, None)
+        if handler is None:
+            self.send_msg(text.actor, f'Command {command} does not exist')
+            return
+        if (self.commands.lane(command) is self.commands.slow and
+                not self.ratelimit.allow(self.requester(text.actor)[0])):
+            self.send_msg(text.actor, 'Slow down, too many requests')
+            return
+        if not self.commands.submit(command, handler, text, parameter,
+                                    on_timeout=partial(self.notify, text.actor, f'!{command} timed out')):
+            self.send_msg(text.actor, 'Busy, try again in a moment')
+
+    def protected_tracks(self):
+        """Ids of the tracks that are playing or will be played and must stay on disk"""
+        with self.lock:
+            protected = {video['id'] for video in self.queue}
+            if self.current_track is not None:
+                protected.add(self.current_track['id'])
+            if self.prefetched is not None:
+                protected.add(self.prefetched[0]['id'])
+        return protected
+
+    def play_entry(self, text, video_entry, starttime=None):
+        """Plays or queues a track from the library, it is downloaded again first if it has been evicted"""
+        if video_entry.evicted:
+            self.cachestats.refetches += 1
+            try:
+                videoid = utils.get_yt_video_id(video_entry.url)
+            except (ValueError, KeyError, IndexError):
+                self.queue_download(text, video_entry.id, video_entry.title, starttime,
+                                    self.download_mp3, video_entry.url, video_entry.id)
+            else:
+                self.queue_download(text, video_entry.id, video_entry.title, starttime,
+                                    self.download_youtube, video_entry.url, video_entry.id, videoid)
+            return
+        self.cachestats.hits += 1
+        video = video_entry.as_dict()
+        if starttime:
+            video['starttime'] = starttime
+        self.play_or_queue(video, self.requester(text.actor))
+
+    def cmd_stats(self, text, _):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER:
+            self.send_msg(text.actor, '<br>' + '<br>'.join(metrics.describe()))
+
+    def cmd_cachestats(self, text, _):
+        self.send_msg(text.actor, self.cachestats.describe())
+
+    def requester(self, actor):
+        """Key and name a user's queue entries are filed under, the certificate hash is kept across reconnects"""
+        user = self.mumble.users[actor]
+        return user['hash'] or user['name'], user['name']
+
+    def play_or_queue(self, video, user=(None, None)):
+        with self.lock:
+            if self.playing:
+                logging.debug("Track appended to queue")
+                self.queue.push(video, *user)
+            else:
+                logging.debug("Playing requested track")
+                self.current_track = video
+                self.launch_play_file(self.current_track)
+
+    def pick_random(self, amount=1):
+        ids = [self.shuffle.pick() for _ in range(min(amount, len(self.shuffle)))]
+        rows = {row.id: row for row in Video.select().where(Video.id.in_(ids))}
+        for videoid in ids:
+            if videoid not in rows:
+                logging.warning("Track %s in shuffle bag but not in database", videoid)
+                self.shuffle.remove(videoid)
+            elif not os.path.exists(os.path.join(self.filedir, videoid)):
+                logging.warning("File of %s is missing", videoid)
+                self.shared.evicted(videoid)
+                del rows[videoid]
+        return [rows[videoid].as_dict() for videoid in ids if videoid in rows]
+
+    def random(self, amount=1, user=(None, None)):
+        for video in self.pick_random(amount):
+            self.play_or_queue(video, user)
+
+    def cmd_random(self, text, parameter):
+        if parameter is not None:
+            amount = int(parameter)
+        else:
+            amount = 1
+        if 1 <= amount <= 10:
+            self.send_msg(text.actor, f'Adding {amount} videos to the queue')
+            self.random(amount, self.requester(text.actor))
+
+    def cmd_join(self, text, _):
+        self.mumble.users.myself.move_in(self.mumble.users[text.actor]['channel_id'])
+
+    def cmd_stop(self, *_):
+        self.stop()
+        self.state.schedule()
+
+    def position(self):
+        """Seconds into the current track that are being heard right now"""
+        source = self.source
+        if source is None:
+            return 0.0
+        buffered = self.mumble.sound_output.get_buffer_size()
+        return max(0.0, source.tell() / SAMPLE_RATE - buffered)
+
+    def seek(self, seconds):
+        """Jumps to seconds into the current track, by offset in cached PCM or by restarting the decoder otherwise"""
+        with self.lock:
+            seconds = max(0.0, seconds)
+            if isinstance(self.source, PcmSource):
+                self.source.seek(seconds)
+            else:
+                self.source.close()
+                self.source = self.open_source(dict(self.current_track, starttime=seconds))
+            self.mumble.sound_output.clear_buffer()
+        self.state.schedule()
+
+    def saved_position(self):
+        with self.lock:
+            if not self.playing or self.source is None:
+                return None
+            return {'id': self.current_track['id'], 'position': self.position(), 'paused': self.paused}
+
+    def resume_saved(self):
+        """Continues the track that was playing when the bot last stopped"""
+        saved = self.state.get('position')
+        if not saved:
+            return
+        row = Video.get_or_none((Video.id == saved['id']) & ~Video.evicted)
+        if row is None:
+            return
+        logging.info("Resuming %s at %.0f s", row.id, saved['position'])
+        video = row.as_dict()
+        video['starttime'] = saved['position']
+        with self.lock:
+            self.current_track = video
+            self.launch_play_file(video)
+            self.paused = saved.get('paused', False)
+
+    def cmd_pause(self, text, _):
+        if not self.playing:
+            self.send_msg(text.actor, 'Nothing is playing')
+            return
+        self.paused = True
+        self.mumble.users.myself.comment(f"Paused:<br>{self.current_track['title']}")
+        self.state.schedule()
+
+    def cmd_resume(self, text, _):
+        if not self.paused:
+            self.send_msg(text.actor, 'Not paused')
+            return
+        self.paused = False
+        self.track_comment()
+        self.state.schedule()
+
+    def cmd_seek(self, text, parameter):
+        if not self.playing:
+            self.send_msg(text.actor, 'Nothing is playing')
+            return
+        if isinstance(self.source, StreamSource):
+            self.send_msg(text.actor, 'Seeking works once the track has finished downloading')
+            return
+        try:
+            seconds, relative = utils.parse_position(parameter or '')
+        except ValueError:
+            self.send_msg(text.actor, 'Give a position like 1:30, 90, +10 or -10')
+            return
+        if relative:
+            seconds += self.position()
+        duration = self.current_track.get('duration')
+        if duration and seconds >= duration:
+            self.send_msg(text.actor, 'That is past the end of the track')
+            return
+        self.seek(seconds)
+
+    def cmd_play(self, text, _):
+        if self.paused:
+            self.cmd_resume(text, None)
+        elif not self.playing:
+            self.playnext()
+        else:
+            self.send_msg(text.actor, 'I am already playing. Maybe use !skip instead?')
+
+    def cmd_skip(self, *_):
+        self.playnext()
+
+    def cmd_np(self, text, _):
+        if self.playing:
+            position = utils.format_position(self.position())
+            if self.current_track.get('duration'):
+                position += f" / {utils.format_position(self.current_track['duration'])}"
+            if self.paused:
+                position += ' (paused)'
+            self.send_msg(text.actor, f"<br>np: {self.current_track['title']} [{position}]<br>"
+                                      f"<a href=\"{self.current_track['url']}\">{self.current_track['url']}</a>")
+        else:
+            self.send_msg(text.actor, 'Stopped')
+
+    def cmd_youtube(self, text, parameter):
+        if self.ytmeta is None:
+            self.send_msg(text.actor, 'YouTube API Key not set')
+            return
+
+        if parameter is None:
+            self.send_msg(text.actor, 'No video given')
+            return
+
+        url, urlhash = utils.parse_parameter(parameter)
+        try:
+            videoid = utils.get_yt_video_id(url)
+        except (ValueError, KeyError, IndexError):
+            self.send_msg(text.actor, 'Invalid YouTube link')
+            return
+        canonical, canonicalhash = utils.canonical_youtube_url(videoid)
+        if self.acl.is_blacklisted(canonicalhash) or self.acl.is_blacklisted(urlhash):
+            self.send_msg(text.actor, 'Video blacklisted')
+            return
+
+        starttime = utils.parse_timecode(url)
+        video_entry = Video.get_or_none(Video.id.in_([canonicalhash, urlhash]))
+        if video_entry is None:
+            self.queue_download(text, canonicalhash, canonical, starttime,
+                                self.download_youtube, canonical, canonicalhash, videoid)
+            return
+        self.play_entry(text, video_entry, starttime)
+
+    def cmd_mp3(self, text, parameter):
+        if parameter is not None:
+            url, urlhash = utils.parse_parameter(parameter)
+            try:
+                video_entry = Video.get_by_id(urlhash)
+            except Video.DoesNotExist:
+                if self.acl.is_blacklisted(urlhash):
+                    self.send_msg(text.actor, 'Video blacklisted')
+                    return
+                self.queue_download(text, urlhash, url, None, self.download_mp3, url, urlhash)
+                return
+            self.play_entry(text, video_entry)
+        else:
+            self.send_msg(text.actor, 'No video given')
+
+    def queue_download(self, text, urlhash, title, starttime, func, *args):
+        self.cachestats.misses += 1
+        job, created = self.downloads.submit(urlhash, title, text.actor, func, *args,
+                                             callback=partial(self.download_finished, text.actor,
+                                                              self.requester(text.actor), starttime))
+        if created:
+            job.starttime = starttime
+            self.send_msg(text.actor, f'Queued for download (job #{job.id})')
+        else:
+            self.send_msg(text.actor, f'Already downloading, added your request to job #{job.id}')
+
+    def download_finished(self, requester, user, starttime, job):
+        try:
+            video = dict(job.future.result())
+        except DownloadError as e:
+            self.notify(requester, str(e))
+            return
+        except Exception:  # pylint: disable=broad-except
+            self.notify(requester, 'Error downloading video')
+            return
+        if job.claim_stream():
+            return
+        if starttime:
+            video['starttime'] = starttime
+        self.play_or_queue(video, user)
+
+    def cmd_playlist(self, text, parameter):
+        if self.ytmeta is None:
+            self.send_msg(text.actor, 'YouTube API Key not set')
+            return
+        if not parameter:
+            self.send_msg(text.actor, 'No playlist given')
+            return
+        urls = utils.parse_urls(parameter)
+        imp = self.imports.start(urls[0] if len(urls) == 1 else f'{len(urls)} links', text.actor,
+                                 self.requester(text.actor))
+        threading.Thread(target=self.run_import, args=(imp, urls), name=f'import-{imp.id}', daemon=True).start()
+        self.send_msg(text.actor, f'Importing (import #{imp.id}), tracks are queued as they finish downloading')
+    cmd_import = cmd_playlist
+
+    def run_import(self, imp, urls):
+        # Limits how much of the download pool one import can take, so other requests still get through
+        slots = threading.BoundedSemaphore(self.config.as_int('download_workers'))
+        try:
+            for batch in resolve_in_batches(imp, urls, self.config.as_int('playlist_limit'), MAX_BATCH):
+                metadata = self.ytmeta.get_many(batch)
+                for videoid in batch:
+                    if imp.cancelled:
+                        return
+                    self.import_entry(imp, videoid, metadata[videoid], slots)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Import %s failed", imp.id)
+        finally:
+            imp.resolving = False
+        logging.info("Import %s resolved %d tracks", imp.id, imp.resolved)
+
+    def import_entry(self, imp, videoid, metadata, slots):
+        url, urlhash = utils.canonical_youtube_url(videoid)
+        if (isinstance(metadata, VideoUnavailable) or metadata['duration'] > 3600 or
+                self.acl.is_blacklisted(urlhash)):
+            imp.failed += 1
+            return
+        existing = Video.get_or_none(Video.id == urlhash)
+        if existing is not None and not existing.evicted:
+            imp.queued += 1
+            self.play_or_queue(existing.as_dict(), imp.user)
+            return
+        while not slots.acquire(timeout=1):
+            if imp.cancelled:
+                return
+        job, created = self.downloads.submit(urlhash, metadata['title'], imp.requester,
+                                             self.download_youtube, url, urlhash, videoid,
+                                             callback=partial(self.import_finished, imp, slots))
+        if created:
+            imp.jobs.append(job)
+
+    def import_finished(self, imp, slots, job):
+        slots.release()
+        try:
+            video = dict(job.future.result())
+        except Exception:  # pylint: disable=broad-except
+            imp.failed += 1
+            return
+        if imp.cancelled:
+            return
+        imp.queued += 1
+        if not job.claim_stream():
+            self.play_or_queue(video, imp.user)
+
+    def cmd_imports(self, text, _):
+        imports = self.imports.list_imports()
+        if imports:
+            self.send_msg(text.actor, '<br>' + '<br>'.join(imp.describe() for imp in imports))
+        else:
+            self.send_msg(text.actor, 'No imports')
+
+    def cmd_cancel(self, text, parameter):
+        imp = self.imports.get(int(parameter)) if parameter and parameter.isdigit() else None
+        if imp is None:
+            self.send_msg(text.actor, 'No such import')
+            return
+        if imp.requester != text.actor and self.acl.is_admin(self.mumble.users[text.actor]) == USER:
+            self.send_msg(text.actor, 'You can only cancel your own imports')
+            return
+        imp.cancel(self.downloads)
+        self.send_msg(text.actor, f'Import #{imp.id} cancelled')
+
+    def notify(self, target, msg):
+        """Like send_msg, but the target may have disconnected in the meantime"""
+        try:
+            self.send_msg(target, msg)
+        except KeyError:
+            logging.debug("Could not notify %s, user has left", target)
+
+    def cmd_jobs(self, text, _):
+        jobs = self.downloads.list_jobs()
+        if jobs:
+            self.send_msg(text.actor, '<br>' + '<br>'.join(job.describe() for job in jobs))
+        else:
+            self.send_msg(text.actor, 'No download jobs')
+
+    def cmd_search(self, text, parameter):
+        if not parameter:
+            self.send_msg(text.actor, 'No search terms given')
+            return
+        results = search(parameter)
+        if not results:
+            self.send_msg(text.actor, 'No matches')
+            return
+        self.search_results[self.requester(text.actor)[0]] = [videoid for videoid, _ in results]
+        lines = [f'{number}. {title}' for number, (_, title) in enumerate(results, 1)]
+        self.send_msg(text.actor, '<br>' + '<br>'.join(lines))
+
+    def cmd_playsearch(self, text, parameter):
+        results = self.search_results.get(self.requester(text.actor)[0])
+        if not results:
+            self.send_msg(text.actor, 'Use !search first')
+            return
+        if parameter is None or not parameter.isdigit() or not 1 <= int(parameter) <= len(results):
+            self.send_msg(text.actor, f'Give a result number between 1 and {len(results)}')
+            return
+        try:
+            video_entry = Video.get_by_id(results[int(parameter) - 1])
+        except Video.DoesNotExist:
+            self.send_msg(text.actor, 'Track has been deleted')
+            return
+        self.play_entry(text, video_entry)
+
+    def cmd_queue(self, text, _):
+        entries = self.queue.ordered()
+        if not entries:
+            self.send_msg(text.actor, 'No tracks in queue')
+            return
+        lines = [f'{len(entries)} tracks in queue']
+        lines += [f"#{entry.id} {entry.video['title']} ({entry.name or 'random'})" for entry in entries[:10]]
+        if len(entries) > 10:
+            lines.append('...')
+        self.send_msg(text.actor, '<br>' + '<br>'.join(lines))
+    cmd_numtracks = cmd_queue
+
+    def queue_entry(self, text, parameter):
+        """Returns the queue entry given as #id in parameter if the user may change it, otherwise tells them why not"""
+        entry = None
+        if parameter and parameter.lstrip('#').isdigit():
+            entry = self.queue.get(int(parameter.lstrip('#')))
+        if entry is None:
+            self.send_msg(text.actor, 'No such queue entry, see !queue')
+        elif (entry.requester != self.requester(text.actor)[0] and
+              self.acl.is_admin(self.mumble.users[text.actor]) == USER):
+            self.send_msg(text.actor, 'You can only change your own tracks')
+            entry = None
+        return entry
+
+    def cmd_remove(self, text, parameter):
+        entry = self.queue_entry(text, parameter)
+        if entry is not None and self.queue.remove(entry.id) is not None:
+            self.send_msg(text.actor, f"Removed {entry.video['title']}")
+
+    def cmd_move(self, text, parameter):
+        """Moves a track to the front of its requester's tracks, admins move it to the front of the whole queue"""
+        entry = self.queue_entry(text, parameter)
+        if entry is None:
+            return
+        jump = self.acl.is_admin(self.mumble.users[text.actor]) > USER
+        if self.queue.move_to_front(entry.id, jump) is not None:
+            self.send_msg(text.actor, f"Moved {entry.video['title']} to the front")
+
+    def cmd_clear(self, text, parameter):
+        if parameter == 'mine':
+            removed = self.queue.clear(self.requester(text.actor)[0])
+        elif self.acl.is_admin(self.mumble.users[text.actor]) > USER:
+            removed = self.queue.clear(everyone=True)
+        else:
+            self.send_msg(text.actor, 'Use !clear mine to remove your tracks')
+            return
+        self.send_msg(text.actor, f'Removed {removed} tracks from the queue')
+
+    def restore_queue(self):
+        """Queues the tracks that were queued when the bot last stopped"""
+        saved = self.state.get('queue', [])
+        rows = {}
+        ids = list({videoid for videoid, *_ in saved})
+        for start in range(0, len(ids), 500):
+            rows.update((row.id, row) for row in
+                        Video.select().where(Video.id.in_(ids[start:start + 500]) & ~Video.evicted))
+        for videoid, requester, name, starttime in saved:
+            if videoid not in rows:
+                logging.info("Dropping %s from the saved queue, it is no longer in the library", videoid)
+                continue
+            video = rows[videoid].as_dict()
+            if starttime:
+                video['starttime'] = starttime
+            self.queue.push(video, requester, name)
+        logging.info("Restored %d queued tracks", len(self.queue))
+
+    def cmd_volume(self, text, parameter):
+        if (parameter is not None and parameter.isdigit() and
+                0 <= int(parameter) <= 100):
+            self.volume = float(float(parameter) / 100)
+            self.dsp.gain.target = self.volume
+            self.set_option('volume', self.volume)
+            self.send_msg_channel(f"Vol: {int(self.volume * 100)}% by {self.mumble.users[text.actor]['name']}")
+        else:
+            self.send_msg(text.actor, f'Volume: {int(self.volume * 100)}%')
+
+    def download_youtube(self, job, url, urlhash, videoid):
+        existing = Video.get_or_none(Video.id == urlhash)
+        if existing is not None and not existing.evicted:
+            return existing.as_dict()
+        try:
+            metadata = self.ytmeta.get(videoid)
+        except VideoUnavailable as e:
+            raise DownloadError('Video not found') from e
+        if metadata['duration'] > 3600:
+            raise DownloadError('Video too long')
+        video = {'id': urlhash, 'url': url, 'title': metadata['title'], 'duration': metadata['duration']}
+        job.title = video['title']
+        with metrics.YTDLP_DURATION.time():
+            part = self.download_to_part(job, video, self.youtube_chunks(job, videoid))
+        file = os.path.join(self.filedir, video['id'])
+        try:
+            self.store_audio(job, part, file)
+        except sp.TimeoutExpired as e:
+            raise DownloadError('Download timed out') from e
+        except (sp.CalledProcessError, StopIteration, ValueError, KeyError) as e:
+            raise DownloadError('Error converting video') from e
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        return self.ingest(job, video, file, existing is not None)
+
+    def store_audio(self, job, part, file):
+        """Moves a downloaded file into place, only the audio stream is kept
+
+        With ingest_format = source the audio stream is stored as it came, remuxed without video if the download had
+        any. With ingest_format = mp3 it is transcoded to mp3 like before.
+        """
+        command = ['ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', part, '-vn', '-map', '0:a:0']
+        if self.config['ingest_format'] == 'mp3':
+            command += ['-codec:a', 'libmp3lame', '-q:a', '2', '-f', 'mp3']
+        else:
+            info = probe(part, timeout=job.deadline.remaining())
+            if not info['video_stream']:
+                os.replace(part, file)
+                return
+            command += ['-codec:a', 'copy', '-f', 'matroska']
+        sp.run(command + [f'{file}.tmp'], check=True, timeout=job.deadline.remaining())
+        os.replace(f'{file}.tmp', file)
+
+    @staticmethod
+    def youtube_chunks(job, videoid):
+        command = ['yt-dlp', '-f', 'bestaudio/best', '--no-playlist', '-4', '--newline', '-o', '-', '--', videoid]
+        with sp.Popen(command, stdout=sp.PIPE, stderr=sp.PIPE) as process:
+            job.deadline.attach(process)
+            threading.Thread(target=track_progress, args=(job, process.stderr), daemon=True).start()
+            yield from iter(partial(process.stdout.read, 65536), b'')
+        if job.deadline.expired:
+            raise DownloadError('Download timed out')
+        if process.returncode != 0:
+            raise DownloadError('Error downloading video')
+
+    def download_mp3(self, job, url, urlhash):
+        existing = Video.get_or_none(Video.id == urlhash)
+        if existing is not None and not existing.evicted:
+            return existing.as_dict()
+        video = {'id': urlhash, 'url': url, 'title': existing.title if existing else url.split('/')[-1]}
+        try:
+            part = self.download_to_part(job, video, self.http_chunks(job, url))
+        except requests.RequestException as e:
+            raise DownloadError('Error downloading file') from e
+        file = os.path.join(self.filedir, video['id'])
+        os.replace(part, file)
+        return self.ingest(job, video, file, existing is not None)
+
+    @staticmethod
+    def http_chunks(job, url):
+        with requests.get(url, stream=True, timeout=60) as request:
+            request.raise_for_status()
+            total = int(request.headers.get('content-length', 0))
+            done = 0
+            for chunk in request.iter_content(chunk_size=65536):
+                if job.deadline.expired:
+                    raise DownloadError('Download timed out')
+                done += len(chunk)
+                if total:
+                    job.progress = done * 100 / total
+                yield chunk
+
+    def download_to_part(self, job, video, chunks):
+        """Writes a download to a partial file in the file directory and returns its path
+
+        If nothing else is playing, the track starts playing from the partial file as soon as the first bytes arrive.
+        """
+        part = os.path.join(self.filedir, f"{video['id']}.part")
+        complete = threading.Event()
+        tried_stream = not self.config.as_bool('progressive')
+        try:
+            with open(part, 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    if job.streamed:
+                        file.flush()
+                    elif not tried_stream:
+                        file.flush()
+                        tried_stream = True
+                        job.streamed = self.start_stream(job, video, part, complete)
+        except BaseException:
+            os.remove(part)
+            raise
+        finally:
+            complete.set()
+        return part
+
+    def start_stream(self, job, video, part, complete):
+        with self.lock:
+            if self.playing or self.queue:
+                return False
+            logging.debug("Playing %s while it downloads", video['id'])
+            video = dict(video)
+            if job.starttime:
+                video['starttime'] = job.starttime
+            self.current_track = video
+            self.launch_play_file(video, StreamSource(part, complete, job.starttime, loudness.audio_filter(video),
+                                                      video.get('duration')))
+        return True
+
+    def ingest(self, job, video, file, refetch=False):
+        """Measures and stores a downloaded track, its decoded audio is cached in the background
+
+        Measuring is bounded by the job's deadline, a track it runs out on is stored unmeasured and plays with loudnorm.
+        """
+        if job.deadline.expired:
+            # Cancelled, or out of time before measuring could start
+            utils.remove_file(file)
+            raise DownloadError('Download timed out')
+        try:
+            video.update(loudness.analyze(file, timeout=job.deadline.remaining()))
+        except (sp.SubprocessError, ValueError, KeyError):
+            logging.warning("Loudness analysis failed for %s, using loudnorm", video['id'])
+        try:
+            info = probe(file, timeout=job.deadline.remaining())
+            video.update(container=info['container'], codec=info['codec'])
+            if not video.get('duration'):
+                video['duration'] = info['duration']
+        except (sp.SubprocessError, StopIteration, ValueError, KeyError):
+            logging.warning("Could not probe %s", video['id'])
+        stat = os.stat(file)
+        video.update(file_size=stat.st_size, file_mtime=stat.st_mtime)
+        video = self.db_create_video(video, refetch)
+        self.pcmcache.ingest_async(file, video['id'], loudness.audio_filter(video))
+        self.evictor.wake()
+        return video
+
+    def db_create_video(self, video, refetch=False):
+        fields = {'url': video['url'], 'title': video['title'], 'duration': video.get('duration'),
+                  'integrated_lufs': video.get('integrated_lufs'), 'true_peak': video.get('true_peak'),
+                  'lra': video.get('lra'), 'container': video.get('container'), 'codec': video.get('codec'),
+                  'file_size': video.get('file_size'), 'file_mtime': video.get('file_mtime'),
+                  'last_played': time.time()}
+        try:
+            if refetch:
+                self.dbwriter.submit(Video.update(evicted=False, **fields).where(Video.id == video['id']).execute)
+            else:
+                self.dbwriter.submit(Video.create, id=video['id'], **fields).result()
+            self.shuffle.add(video['id'])
+            return video
+        except IntegrityError as e:
+            utils.remove_file(os.path.join(self.filedir, video['id']))
+            raise DownloadError('Failed to download due to database error.') from e
+
+    def cmd_delete(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER:
+            video = None
+            resume = False
+            if parameter is not None:
+                url = utils.parse_parameter(parameter)[0]
+                video = Video.get_or_none(Video.id.in_(utils.url_hashes(url)))
+            else:
+                if self.playing:
+                    resume = True
+                    logging.debug("Selecting currently playing track for deletion")
+                    video = Video.get_or_none(Video.id == self.current_track['id'])
+                    self.stop()
+                else:
+                    self.send_msg(text.actor, 'No video defined')
+            if video is not None:
+                if not video.evicted and not utils.remove_file(os.path.join(self.filedir, video.id)):
+                    logging.warning("File of %s was already gone", video.id)
+                self.pcmcache.remove(video.id)
+                logging.debug("Removed video file %s", video.id)
+                self.dbwriter.submit(video.delete_instance)
+                self.shuffle.remove(video.id)
+                logging.debug("Removed database entry for video")
+                self.send_msg(text.actor, 'Deleted succesfully')
+            else:
+                self.send_msg(text.actor, 'Failed to delete')
+            if resume:
+                logging.debug("Resuming playback")
+                self.playnext()
+
+    def cmd_blacklist(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER:
+            video = None
+            if parameter is not None:
+                url = utils.parse_parameter(parameter)[0]
+                video = Video.get_or_none(Video.id.in_(utils.url_hashes(url)))
+            else:
+                if self.playing:
+                    video = Video.get_or_none(Video.id == self.current_track['id'])
+                    self.playnext()
+            if video is not None:
+                if not video.evicted:
+                    utils.remove_file(os.path.join(self.filedir, video.id))
+                self.pcmcache.remove(video.id)
+                self.dbwriter.submit(video.delete_instance)
+                self.shuffle.remove(video.id)
+                self.acl.add('blacklist', video.id)
+                self.send_msg(text.actor, 'Blacklisted succesfully')
+            else:
+                self.send_msg(text.actor, 'Failed to blacklist')
+
+    def cmd_unblacklist(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER and parameter:
+            url = utils.parse_parameter(parameter)[0]
+            removed = [self.acl.remove('blacklist', urlhash) for urlhash in utils.url_hashes(url)]
+            if any(removed):
+                self.send_msg(text.actor, "Blacklist removal successful")
+
+    def cmd_togglerandom(self, text, _):
+        togglerandom = self.config.as_bool('random')
+        if togglerandom:
+            self.set_option('random', False)
+            self.send_msg(text.actor, 'Random playback stopped')
+        else:
+            self.set_option('random', True)
+            self.send_msg(text.actor, 'Random playback started')
+            if not self.playing:
+                self.random()
+
+    def cmd_hash(self, text, parameter):
+        if parameter and self.acl.is_admin(self.mumble.users[text.actor]) == OWNER:
+            for session in self.mumble.users:
+                if self.mumble.users[session]['name'] == parameter:
+                    self.send_msg(text.actor, self.mumble.users[session]['hash'])
+                    return
+        else:
+            self.send_msg(text.actor, self.mumble.users[text.actor]['hash'])
+
+    def cmd_admin(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) == OWNER and parameter:
+            for session in self.mumble.users:
+                if self.mumble.users[session]['name'] == parameter:
+                    user = self.mumble.users[session]
+                    if self.acl.is_admin(user) != OWNER:
+                        self.acl.add('admins', user['hash'])
+                    break
+
+    def cmd_unadmin(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) == OWNER and parameter:
+            for session in self.mumble.users:
+                if self.mumble.users[session]['name'] == parameter:
+                    user = self.mumble.users[session]
+                    self.acl.remove('admins', user['hash'])
+                    break
+
+    def cmd_ignore(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER and parameter:
+            for session in self.mumble.users:
+                if self.mumble.users[session]['name'] == parameter:
+                    user = self.mumble.users[session]
+                    if self.acl.is_admin(user) != OWNER:
+                        self.acl.add('ignored', user['hash'])
+                    self.send_msg(text.actor, f"{user['name']}({user['session']}) added to ignore list")
+                    break
+
+    def cmd_unignore(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER and parameter:
+            for session in self.mumble.users:
+                if self.mumble.users[session]['name'] == parameter:
+                    user = self.mumble.users[session]
+                    self.acl.remove('ignored', user['hash'])
+                    self.send_msg(text.actor, f"{user['name']}({user['session']}) removed from ignore list")
+                    break
+
+    def cmd_set(self, text, parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER and parameter:
+            parameter = parameter.split(' ', 1)
+            if len(parameter) < 2:
+                self.send_msg(text.actor, 'No value given')
+                return
+            value = parameter[1].lower() in ('1', 'true', 'on', 'yes')
+            if parameter[0] == 'ignore_private':
+                self.set_option('ignore_private', value)
+            elif parameter[0] == 'same_channel':
+                self.set_option('same_channel', value)
+            elif parameter[0] == 'limiter':
+                self.set_option('limiter', value)
+                self.dsp.limiter.enabled = value
+            elif parameter[0] == 'eq':
+                if parameter[1] not in dsp.EQ_PRESETS:
+                    self.send_msg(text.actor, f"Unknown EQ preset, available: {', '.join(dsp.EQ_PRESETS)}")
+                    return
+                self.set_option('eq', parameter[1])
+                self.dsp.equalizer.set_preset(parameter[1])
+            self.send_msg(text.actor, "Config value set")
+
+    def set_option(self, key, value):
+        """Changes a setting of this session and saves it to the config in the background"""
+        self.config[key] = value
+        self.settings[key] = value
+        self.config_writer.schedule()
+
+    def cmd_kill(self, text, _parameter):
+        if self.acl.is_admin(self.mumble.users[text.actor]) > USER:
+            # Saved before stopping, so the next start continues the current track
+            self.state.flush()
+            self.stop()
+            self.commands.shutdown()
+            self.shared.release(self)
+            self.config_writer.flush()
+            self.exit = True
@@ -0,0 +1,203 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from functools import partial
+
+from musabot import deadline as deadlines
+from musabot.models import db
+
+# Playback control runs on its own lane, so it answers even while the slow lane is busy with ingest commands
+FAST_COMMANDS = {'stop', 'skip', 'play', 'vol', 'v', 'volume', 'np', 'pause', 'resume', 'seek'}
+FAST_TIMEOUT = 5
+SLOW_TIMEOUT = 30
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def take(self, cost=1):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    """A token bucket per user, rate tokens are added per second up to burst, 0 rate disables limiting"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket.take(cost)
+
+
+class Call:
+    def __init__(self, command, func, args, deadline):
+        self.command = command
+        self.func = func
+        self.args = args
+        self.deadline = deadline
+        self.started = False
+        self.done = False
+        self.replaced = False
+
+
+class Lane:
+    """Runs commands in order on a fixed set of long lived worker threads
+
+    A command that is still running when its deadline passes gets a replacement worker, so the lane keeps moving, and
+    its own worker exits once the command returns. Subprocesses attached to the deadline are killed, the late command
+    is left to finish on its own. At most max_replacements workers are stuck in late commands at a time, past that the
+    lane runs with fewer workers until one of them returns.
+    """
+
+    def __init__(self, name, workers, timeout, max_pending, max_replacements=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_replacements = workers if max_replacements is None else max_replacements
+        self.pending = 0
+        self.replacements = 0
+        self.workers = 0
+        self.calls = queue.Queue()
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        with self.lock:
+            for _ in range(workers):
+                self._start_worker()
+
+    def _start_worker(self):
+        self.workers += 1
+        threading.Thread(target=self._work, name=f'commands-{self.name}-{next(self.counter)}', daemon=True).start()
+
+    def submit(self, call):
+        """Queues call, returns False if max_pending commands are queued or running already"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+        self.calls.put(call)
+        return True
+
+    def release(self, call):
+        """Takes call off the lane, returns False if it was already"""
+        with self.lock:
+            if call.done:
+                return False
+            call.done = True
+            self.pending -= 1
+        return True
+
+    def _work(self):
+        try:
+            while True:
+                call = self.calls.get()
+                if call is None:
+                    return
+                with self.lock:
+                    if call.done:
+                        continue
+                    call.started = True
+                self._run(call)
+                if call.replaced:
+                    with self.lock:
+                        self.replacements -= 1
+                    return
+        finally:
+            with self.lock:
+                self.workers -= 1
+            # Commands read the database, peewee keeps a connection per thread until it is closed
+            db.close()
+
+    def _run(self, call):
+        try:
+            call.func(*call.args)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Command !%s failed", call.command)
+        finally:
+            call.deadline.finish()
+            self.release(call)
+
+    def expire(self, call, on_timeout):
+        # Releasing and replacing under one lock, the worker looks at replaced once its own release is done
+        with self.lock:
+            if call.done:
+                return
+            call.done = True
+            self.pending -= 1
+            if call.started and self.replacements < self.max_replacements:
+                self.replacements += 1
+                call.replaced = True
+                self._start_worker()
+        if call.started:
+            logging.warning("!%s overran its deadline%s", call.command,
+                            ', starting another worker' if call.replaced else ', too many workers are stuck already')
+        else:
+            logging.warning("Dropping !%s, it waited past its deadline", call.command)
+        if on_timeout is not None:
+            on_timeout()
+
+    def shutdown(self):
+        """Commands that haven't started yet are dropped, idle workers exit"""
+        with self.lock:
+            while True:
+                try:
+                    call = self.calls.get_nowait()
+                except queue.Empty:
+                    break
+                if call is not None and not call.done:
+                    call.done = True
+                    self.pending -= 1
+            for _ in range(self.workers):
+                self.calls.put(None)
+
+
+class CommandExecutor:
+    """Runs commands off the thread that receives them, on a fast lane for playback control and a slow lane for the
+    rest
+
+    Every command gets a deadline, starting when it is submitted. When it passes, on_timeout is called, a command
+    that hasn't started yet is dropped and a running one is handed its own thread while the lane goes on. A lane with
+    max_pending commands queued or running sheds new ones.
+    """
+
+    def __init__(self, slow_workers=2, max_pending=20):
+        self.fast = Lane('fast', 1, FAST_TIMEOUT, max_pending)
+        self.slow = Lane('slow', slow_workers, SLOW_TIMEOUT, max_pending)
+
+    def lane(self, command):
+        return self.fast if command in FAST_COMMANDS else self.slow
+
+    def submit(self, command, func, *args, on_timeout=None):
+        """Queues func(*args), returns False if the lane is too busy to take it"""
+        lane = self.lane(command)
+        call = Call(command, func, args, deadlines.Deadline(lane.timeout))
+        if not lane.submit(call):
+            logging.warning("Shedding !%s, %d commands waiting on the %s lane", command, lane.pending, lane.name)
+            return False
+        deadlines.watch(call.deadline, partial(lane.expire, call, on_timeout))
+        return True
+
+    def shutdown(self):
+        for lane in (self.fast, self.slow):
+            lane.shutdown()
@@ -0,0 +1,20 @@
+import logging
+import threading
+
+from musabot.debounce import Debouncer
+
+
+class ConfigWriter:
+    """Writes the config to disk in the background, at most once per delay however often it changes"""
+
+    def __init__(self, config, delay=2.0):
+        self.config = config
+        self.lock = threading.Lock()
+        self.debouncer = Debouncer(self.write, delay)
+        self.schedule = self.debouncer.schedule
+        self.flush = self.debouncer.flush
+
+    def write(self):
+        with self.lock:
+            logging.debug("Writing config")
+            self.config.write()
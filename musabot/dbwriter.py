@@ -0,0 +1,54 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from musabot import metrics
+
+
+class DbWriter:
+    """Runs database writes on a single thread
+
+    Writes that queue up while a transaction is running are committed together in the next one, each in its own
+    savepoint so a failing write doesn't roll back the others. Callers get a future for the result of their write.
+    """
+
+    def __init__(self, database, batch=100):
+        self.database = database
+        self.batch = batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='dbwriter', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with metrics.DB_WRITE_DURATION.time(), self.database.atomic():
+                    outcomes = [self._apply(func, args, kwargs) for _, func, args, kwargs in items]
+            except Exception as e:  # pylint: disable=broad-except
+                logging.exception("Database write batch failed")
+                outcomes = [(None, e)] * len(items)
+            for (future, *_), (result, error) in zip(items, outcomes):
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            logging.debug("Committed %d database writes", len(items))
+
+    def _apply(self, func, args, kwargs):
+        try:
+            with self.database.atomic():
+                return func(*args, **kwargs), None
+        except Exception as e:  # pylint: disable=broad-except
+            return None, e
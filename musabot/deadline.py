@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Deadline:
+    """Time limit for a piece of work, subprocesses attached to it are killed when it expires
+
+    A deadline of None never expires.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self.expired = False
+        self.finished = False
+        self.processes = []
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left, None if there is no limit"""
+        if self.expired:
+            return 0.0
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def attach(self, process):
+        with self.lock:
+            if self.expired:
+                process.kill()
+            else:
+                self.processes.append(process)
+
+    def expire(self):
+        with self.lock:
+            self.expired = True
+            processes, self.processes = self.processes, []
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def finish(self):
+        self.finished = True
+
+
+class Watchdog:
+    """Expires deadlines on a single thread, callbacks run there too and should be quick"""
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+        self.thread.start()
+
+    def watch(self, deadline, callback=None):
+        if deadline.expires is None:
+            return
+        with self.condition:
+            heapq.heappush(self.heap, (deadline.expires, next(self.counter), deadline, callback))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                _, _, deadline, callback = heapq.heappop(self.heap)
+            if deadline.finished:
+                continue
+            deadline.expire()
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Deadline callback failed")
+
+
+WATCHDOG = None
+WATCHDOG_LOCK = threading.Lock()
+
+
+def watch(deadline, callback=None):
+    """Watches deadline on the shared watchdog thread, which is started on first use"""
+    global WATCHDOG  # pylint: disable=global-statement
+    with WATCHDOG_LOCK:
+        if WATCHDOG is None:
+            WATCHDOG = Watchdog()
+    WATCHDOG.watch(deadline, callback)
@@ -0,0 +1,27 @@
+import threading
+
+
+class Debouncer:
+    """Calls func in the background delay seconds after the first schedule(), so a burst of changes is handled once"""
+
+    def __init__(self, func, delay=2.0):
+        self.func = func
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def schedule(self):
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Calls func right away, instead of when the pending timer fires"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        # Outside the lock, func may take locks of its own that someone waiting in schedule() holds
+        self.func()
@@ -0,0 +1,141 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from musabot import deadline as deadlines
+
+
+class DownloadError(Exception):
+    """A download failed in a way that should be reported to the requester"""
+
+
+class Job:
+    def __init__(self, jobid, title, requester):
+        self.id = jobid
+        self.title = title
+        self.requester = requester
+        self.status = 'queued'
+        self.progress = None
+        self.error = None
+        self.created = time.monotonic()
+        self.future = None
+        self.waiters = 0
+        self.cancelled = False
+        self.starttime = None
+        self.streamed = False
+        self.stream_claimed = threading.Lock()
+        self.deadline = deadlines.Deadline()
+
+    def claim_stream(self):
+        """Returns True once if the track was already played while downloading, for the callback it stands in for"""
+        return self.streamed and self.stream_claimed.acquire(blocking=False)
+
+    def describe(self):
+        if self.status == 'downloading' and self.progress is not None:
+            status = f'downloading {self.progress:.0f}%'
+        elif self.status == 'failed':
+            status = f'failed: {self.error}'
+        else:
+            status = self.status
+        return f'#{self.id} [{status}] {self.title}'
+
+
+class DownloadPool:
+    """Runs downloads on a bounded set of worker threads and keeps a registry of recent jobs
+
+    Jobs are keyed, while a job is queued or running, submitting the same key again attaches to the existing job
+    instead of starting another download. A job that runs longer than timeout seconds has its subprocesses killed.
+    """
+
+    def __init__(self, workers, history=20, timeout=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        self.jobs = OrderedDict()
+        self.inflight = {}
+        self.history = history
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.counter = itertools.count(1)
+
+    def submit(self, key, title, requester, func, *args, callback=None):
+        """Queues func(job, *args) unless a job for key is already in flight
+
+        Returns the job and whether it was newly created. callback is called with the job when it finishes, for every
+        submit that attached to it.
+        """
+        with self.lock:
+            job = self.inflight.get(key)
+            created = job is None
+            if created:
+                job = Job(next(self.counter), title, requester)
+                job.future = self.executor.submit(self._run, job, func, args)
+                self.jobs[job.id] = job
+                self.inflight[key] = job
+                self._prune()
+                job.future.add_done_callback(lambda _: self._finish(key, job))
+            job.waiters += 1
+        if callback is not None:
+            job.future.add_done_callback(lambda _: callback(job))
+        return job, created
+
+    def cancel(self, job):
+        """Cancels a job unless another submit attached to it since, returns whether it was cancelled
+
+        A running job has its deadline expired, which kills its download.
+        """
+        with self.lock:
+            if job.waiters != 1 or job.future.done():
+                return False
+            job.cancelled = True
+            if not job.future.cancel():
+                job.deadline.expire()
+            return True
+
+    def _finish(self, key, job):
+        with self.lock:
+            if self.inflight.get(key) is job:
+                del self.inflight[key]
+        if job.future.cancelled():
+            job.status = 'cancelled'
+
+    def _run(self, job, func, args):
+        job.status = 'downloading'
+        job.deadline = deadlines.Deadline(self.timeout)
+        deadlines.watch(job.deadline)
+        if job.cancelled:
+            # Cancelled between starting and getting its deadline
+            job.deadline.expire()
+        logging.debug("Job %s started", job.id)
+        try:
+            result = func(job, *args)
+        except DownloadError as e:
+            if job.cancelled:
+                job.status = 'cancelled'
+            else:
+                job.status = 'failed'
+                job.error = str(e)
+            raise
+        except Exception:
+            logging.exception("Job %s crashed", job.id)
+            job.status = 'failed'
+            job.error = 'Internal error'
+            raise
+        finally:
+            job.deadline.finish()
+        job.status = 'done'
+        logging.debug("Job %s finished", job.id)
+        return result
+
+    def _prune(self):
+        finished = [jobid for jobid, job in self.jobs.items() if job.status in ('done', 'failed', 'cancelled')]
+        for jobid in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[jobid]
+
+    def list_jobs(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,120 @@
+"""Per block audio processing applied by the feed loop
+
+Every stage works on a whole block of float samples with numpy, so the cost per block is fixed and changes take
+effect on the next block without restarting the decoder.
+"""
+import numpy as np
+
+from musabot import feeder
+from musabot.player import SAMPLE_RATE
+
+EQ_TAPS = 513
+
+# Gain in dB at a few frequencies, interpolated on a log frequency scale in between
+EQ_PRESETS = {
+    'flat': [(20, 0), (20000, 0)],
+    'bass': [(20, 6), (120, 6), (400, 0), (20000, 0)],
+    'treble': [(20, 0), (2000, 0), (6000, 5), (20000, 5)],
+    'voice': [(20, -8), (150, -3), (300, 0), (1000, 3), (3000, 3), (6000, 0), (20000, -3)],
+    'loudness': [(20, 6), (100, 4), (500, 0), (4000, 0), (10000, 3), (20000, 3)],
+}
+
+
+def design_eq(points, taps=EQ_TAPS):
+    """Returns a linear phase FIR filter following the preset's gain curve"""
+    size = 1024
+    freqs = np.fft.rfftfreq(size, 1 / SAMPLE_RATE)
+    point_freqs, point_gains = zip(*points)
+    gains = np.interp(np.log10(np.maximum(freqs, 1)), np.log10(point_freqs), point_gains)
+    impulse = np.fft.irfft(10 ** (gains / 20), size)
+    impulse = np.roll(impulse, taps // 2)[:taps] * np.hanning(taps)
+    return impulse.astype(np.float32)
+
+
+class Gain:
+    """Volume that ramps linearly over one block when changed, so volume changes don't click"""
+
+    def __init__(self, volume):
+        self.target = volume
+        self.current = volume
+
+    def process(self, samples):
+        if self.current == self.target:
+            return samples * self.current
+        ramp = np.linspace(self.current, self.target, len(samples), dtype=np.float32)
+        self.current = self.target
+        return samples * ramp
+
+
+class Limiter:
+    """Block based peak limiter, gain reduction applies from the first sample of a loud block and is released
+    gradually over the following ones"""
+
+    def __init__(self, enabled=True, threshold=0.9, release=0.05):
+        self.enabled = enabled
+        self.threshold = threshold * 32767
+        self.release = release
+        self.gain = 1.0
+
+    def process(self, samples):
+        if not self.enabled or samples.size == 0:
+            self.gain = 1.0
+            return samples
+        peak = float(np.max(np.abs(samples)))
+        target = min(1.0, self.threshold / peak) if peak else 1.0
+        if target > self.gain:
+            target = min(target, self.gain + self.release)
+        if target == self.gain == 1.0:
+            return samples
+        ramp = np.linspace(self.gain, target, len(samples), dtype=np.float32)
+        if target < self.gain:
+            # Ramping the attack in would let the samples before the end of the ramp through over the threshold
+            ramp = np.minimum(ramp, target)
+        self.gain = target
+        return samples * ramp
+
+
+class Equalizer:
+    """FIR equalizer, switching presets crossfades between the old and new filter over one block"""
+
+    def __init__(self, preset='flat'):
+        self.preset = preset
+        self.filter = design_eq(EQ_PRESETS[preset])
+        self.previous = None
+        self.history = np.zeros(EQ_TAPS - 1, dtype=np.float32)
+
+    def set_preset(self, preset):
+        if preset != self.preset:
+            self.previous = self.filter
+            self.filter = design_eq(EQ_PRESETS[preset])
+            self.preset = preset
+
+    def process(self, samples):
+        padded = np.concatenate((self.history, samples))
+        self.history = padded[-(EQ_TAPS - 1):]
+        if self.preset == 'flat' and self.previous is None:
+            # Same delay as the filters, so switching presets doesn't shift the audio
+            delay = EQ_TAPS // 2
+            return padded[delay:delay + len(samples)]
+        output = np.convolve(padded, self.filter, mode='valid').astype(np.float32)
+        if self.previous is not None:
+            old = np.convolve(padded, self.previous, mode='valid')
+            fade = np.linspace(0, 1, len(samples), dtype=np.float32)
+            output = old * (1 - fade) + output * fade
+            self.previous = None
+        return output
+
+
+class Chain:
+    """Equalizer, volume and limiter applied in that order to s16le blocks"""
+
+    def __init__(self, volume, eq='flat', limiter=True):
+        self.equalizer = Equalizer(eq)
+        self.gain = Gain(volume)
+        self.limiter = Limiter(limiter)
+
+    def process(self, block):
+        samples = feeder.to_samples(block)
+        for stage in (self.equalizer, self.gain, self.limiter):
+            samples = stage.process(samples)
+        return feeder.to_block(samples)
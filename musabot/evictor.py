@@ -0,0 +1,86 @@
+import logging
+import math
+import os
+import threading
+
+from musabot import utils
+from musabot.models import Video
+from musabot.reconcile import PARTIAL_SUFFIXES
+
+# How much each doubling of the play count is worth in recency, in seconds
+FREQUENCY_WEIGHT = 7 * 24 * 3600
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.refetches = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe(self):
+        return (f'hits {self.hits}, misses {self.misses} ({self.hit_ratio:.0%} hit ratio), '
+                f'refetched {self.refetches}, evicted {self.evictions} ({self.evicted_bytes / 1024 / 1024:.0f} MB)')
+
+
+def score(row, mtime):
+    """Tracks with the lowest score are evicted first, recently added or played and often played tracks score high"""
+    return (row.last_played or mtime) + FREQUENCY_WEIGHT * math.log2(1 + row.play_count)
+
+
+class Evictor:
+    """Keeps the tracks in filedir under a byte budget
+
+    Evicted tracks keep their Video row, marked as evicted, so they can be downloaded again when requested. Tracks
+    returned by protected() are never evicted.
+    """
+
+    def __init__(self, filedir, budget, protected, on_evict, stats, interval=300):
+        self.filedir = filedir
+        self.budget = budget
+        self.protected = protected
+        self.on_evict = on_evict
+        self.stats = stats
+        self.interval = interval
+        self.wakeup = threading.Event()
+        if budget > 0:
+            threading.Thread(target=self._run, name='evictor', daemon=True).start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.run()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Eviction failed")
+
+    def run(self):
+        files = {entry.name: entry.stat() for entry in os.scandir(self.filedir)
+                 if entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIXES)}
+        total = sum(stat.st_size for stat in files.values())
+        if total <= self.budget:
+            return
+        protected = self.protected()
+        rows = Video.select(Video.id, Video.play_count, Video.last_played).where(~Video.evicted)
+        candidates = sorted((score(row, files[row.id].st_mtime), row.id) for row in rows
+                            if row.id in files and row.id not in protected)
+        for _, videoid in candidates:
+            if total <= self.budget:
+                break
+            size = files[videoid].st_size
+            logging.info("Evicting %s (%d bytes)", videoid, size)
+            utils.remove_file(os.path.join(self.filedir, videoid))
+            self.on_evict(videoid)
+            total -= size
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += size
@@ -0,0 +1,120 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class Entry:
+    def __init__(self, entryid, video, requester, name):
+        self.id = entryid
+        self.video = video
+        self.requester = requester
+        self.name = name
+
+
+class FairQueue:
+    """Play queue that takes turns between requesters
+
+    Every requester has a lane of their tracks, the next track comes from the lane at the front of the rotation, which
+    then moves to the back. Entries get an id that stays the same while they are queued, removing and moving entries
+    by id, pushing and popping are all constant time. on_change is called after every change.
+    """
+
+    def __init__(self, on_change=None):
+        self.lanes = OrderedDict()
+        self.entries = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.RLock()
+        self.on_change = on_change or (lambda: None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """Yields the queued videos in the order they will be played"""
+        return (entry.video for entry in self.ordered())
+
+    def ordered(self):
+        """Returns the entries in the order they will be played"""
+        with self.lock:
+            lanes = [list(lane.values()) for lane in self.lanes.values()]
+        return [entry for turn in itertools.zip_longest(*lanes) for entry in turn if entry is not None]
+
+    def push(self, video, requester=None, name=None):
+        with self.lock:
+            entry = Entry(next(self.counter), video, requester, name)
+            self.lanes.setdefault(requester, OrderedDict())[entry.id] = entry
+            self.entries[entry.id] = entry
+        self.on_change()
+        return entry
+
+    def peek(self):
+        """Returns the video that plays next, or None"""
+        with self.lock:
+            if not self.lanes:
+                return None
+            lane = next(iter(self.lanes.values()))
+            return next(iter(lane.values())).video
+
+    def pop(self):
+        """Removes and returns the video that plays next, raises IndexError if the queue is empty"""
+        with self.lock:
+            if not self.lanes:
+                raise IndexError('pop from an empty queue')
+            requester, lane = next(iter(self.lanes.items()))
+            _, entry = lane.popitem(last=False)
+            del self.entries[entry.id]
+            if lane:
+                self.lanes.move_to_end(requester)
+            else:
+                del self.lanes[requester]
+        self.on_change()
+        return entry.video
+
+    def get(self, entryid):
+        return self.entries.get(entryid)
+
+    def remove(self, entryid):
+        """Removes an entry, returns it or None if there is no such entry"""
+        with self.lock:
+            entry = self.entries.pop(entryid, None)
+            if entry is None:
+                return None
+            lane = self.lanes[entry.requester]
+            del lane[entryid]
+            if not lane:
+                del self.lanes[entry.requester]
+        self.on_change()
+        return entry
+
+    def move_to_front(self, entryid, jump=False):
+        """Makes an entry the next one of its requester, with jump its requester also gets the next turn"""
+        with self.lock:
+            entry = self.entries.get(entryid)
+            if entry is None:
+                return None
+            self.lanes[entry.requester].move_to_end(entryid, last=False)
+            if jump:
+                self.lanes.move_to_end(entry.requester, last=False)
+        self.on_change()
+        return entry
+
+    def clear(self, requester=None, everyone=False):
+        """Removes the entries of requester, or all of them with everyone, returns how many were removed"""
+        with self.lock:
+            if everyone:
+                removed = len(self.entries)
+                self.lanes.clear()
+                self.entries.clear()
+            else:
+                lane = self.lanes.pop(requester, {})
+                removed = len(lane)
+                for entryid in lane:
+                    del self.entries[entryid]
+        if removed:
+            self.on_change()
+        return removed
+
+    def dump(self):
+        """Compact form of the queue, video id, requester, requester name and start time of every entry in order"""
+        return [[entry.video['id'], entry.requester, entry.name, entry.video.get('starttime')]
+                for entry in self.ordered()]
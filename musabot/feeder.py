@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+
+from musabot.player import SAMPLE_RATE, BYTES_PER_SECOND
+
+FRAME_SIZE = SAMPLE_RATE // 50 * 2
+BLOCK_SIZE = FRAME_SIZE * 2
+BLOCK_DURATION = BLOCK_SIZE / BYTES_PER_SECOND
+
+
+def to_samples(block):
+    """Returns the s16le block as float samples, a trailing odd byte is dropped"""
+    return np.frombuffer(block, dtype='<i2', count=len(block) // 2).astype(np.float32)
+
+
+def to_block(samples):
+    return np.clip(samples, -32768, 32767).astype('<i2').tobytes()
+
+
+def apply_gain(block, gain):
+    return to_block(to_samples(block) * gain)
+
+
+def crossfade(current, upcoming, start, end):
+    """Mixes two blocks, the level of current falls linearly from start to end over the block"""
+    current = to_samples(current)
+    upcoming = to_samples(upcoming)
+    length = max(len(current), len(upcoming))
+    current = np.pad(current, (0, length - len(current)))
+    upcoming = np.pad(upcoming, (0, length - len(upcoming)))
+    level = np.linspace(start, end, length, endpoint=False, dtype=np.float32)
+    return to_block(current * level + upcoming * (1 - level))
+
+
+class Pacer:
+    """Schedules the feed loop against the output buffer
+
+    Instead of polling the buffer, the loop sleeps until the moment the buffer is expected to have drained down to
+    the target, then tops it up again.
+    """
+
+    def __init__(self, target=0.5, clock=time.monotonic, sleep=time.sleep):
+        self.target = target
+        self.clock = clock
+        self.sleep = sleep
+
+    def wait(self, buffered):
+        """Sleeps until buffered seconds of audio have played down to the target, returns how late it woke up"""
+        if buffered <= self.target:
+            return 0.0
+        deadline = self.clock() + buffered - self.target
+        self.sleep(deadline - self.clock())
+        return max(0.0, self.clock() - deadline)
@@ -0,0 +1,165 @@
+import itertools
+import logging
+import queue
+import subprocess as sp
+import threading
+from collections import OrderedDict
+
+import requests
+
+from musabot import utils
+from musabot import deadline as deadlines
+
+LIST_EXTENSIONS = ('.txt', '.m3u', '.m3u8')
+# Seconds yt-dlp may take to list one playlist before it is killed
+RESOLVE_TIMEOUT = 300
+
+
+class Import:
+    def __init__(self, importid, title, requester, user=(None, None)):
+        self.id = importid
+        self.title = title
+        self.requester = requester
+        self.user = user
+        self.resolved = 0
+        self.queued = 0
+        self.failed = 0
+        self.resolving = True
+        self.cancelled = False
+        self.jobs = []
+        self.process = None
+
+    @property
+    def finished(self):
+        return self.cancelled or (not self.resolving and self.queued + self.failed >= self.resolved)
+
+    def cancel(self, downloads):
+        """Stops resolving and cancels the downloads of the import, queued or running. Those other requests are waiting
+        for keep running and their tracks are just not queued for the import"""
+        self.cancelled = True
+        if self.process is not None:
+            self.process.kill()
+        for job in self.jobs:
+            downloads.cancel(job)
+
+    def describe(self):
+        if self.cancelled:
+            state = 'cancelled'
+        elif self.resolving:
+            state = 'resolving'
+        elif self.finished:
+            state = 'done'
+        else:
+            state = 'downloading'
+        return f'#{self.id} [{state}] {self.queued}/{self.resolved} queued, {self.failed} failed: {self.title}'
+
+
+class ImportRegistry:
+    def __init__(self, history=10):
+        self.imports = OrderedDict()
+        self.history = history
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    def start(self, title, requester, user=(None, None)):
+        imp = Import(next(self.counter), title, requester, user)
+        with self.lock:
+            self.imports[imp.id] = imp
+            finished = [importid for importid, old in self.imports.items() if old.finished]
+            for importid in finished[:max(0, len(self.imports) - self.history)]:
+                del self.imports[importid]
+        return imp
+
+    def get(self, importid):
+        with self.lock:
+            return self.imports.get(importid)
+
+    def list_imports(self):
+        with self.lock:
+            return list(self.imports.values())
+
+
+def expand_lists(urls):
+    """Replaces links to plain text or m3u lists with the links in them"""
+    for url in urls:
+        if urlpath_endswith(url, LIST_EXTENSIONS):
+            try:
+                response = requests.get(url, timeout=30)
+                response.raise_for_status()
+            except requests.RequestException:
+                logging.warning("Failed to fetch list %s", url)
+                continue
+            yield from (line.strip() for line in response.text.splitlines()
+                        if line.strip() and not line.startswith('#'))
+        else:
+            yield url
+
+
+def urlpath_endswith(url, extensions):
+    return url.split('?', 1)[0].lower().endswith(extensions)
+
+
+def resolve(imp, urls, limit):
+    """Yields the YouTube video ids of urls in order, playlists are expanded with yt-dlp as they are read"""
+    count = 0
+    for url in expand_lists(urls):
+        if imp.cancelled or count >= limit:
+            return
+        if 'list=' not in url and '/playlist' not in url:
+            try:
+                yield utils.get_yt_video_id(url)
+                count += 1
+            except (ValueError, KeyError, IndexError):
+                logging.debug("Skipping %s in import, not a YouTube link", url)
+            continue
+        command = ['yt-dlp', '--flat-playlist', '--print', 'id', '--playlist-end', str(limit - count), '--', url]
+        deadline = deadlines.Deadline(RESOLVE_TIMEOUT)
+        deadlines.watch(deadline)
+        try:
+            with sp.Popen(command, stdout=sp.PIPE, stderr=sp.DEVNULL, text=True) as process:
+                imp.process = process
+                deadline.attach(process)
+                for line in process.stdout:
+                    if line.strip():
+                        yield line.strip()
+                        count += 1
+        finally:
+            deadline.finish()
+            imp.process = None
+        if deadline.expired:
+            logging.warning("Listing %s took too long, import %s continues with what was listed", url, imp.id)
+
+
+def resolve_in_batches(imp, urls, limit, size):
+    """Yields lists of video ids, as many as have been resolved since the last batch, but at most size
+
+    Resolving runs on its own thread so the first ids can be looked up while the rest of a playlist is still being
+    read.
+    """
+    ids = queue.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for videoid in resolve(imp, urls, limit):
+                imp.resolved += 1
+                ids.put(videoid)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Resolving import %s failed", imp.id)
+        finally:
+            ids.put(done)
+
+    threading.Thread(target=produce, name=f'import-{imp.id}-resolve', daemon=True).start()
+    finished = False
+    while not finished:
+        batch = [ids.get()]
+        while len(batch) < size:
+            try:
+                batch.append(ids.get_nowait())
+            except queue.Empty:
+                break
+        if batch[-1] is done:
+            batch.pop()
+            finished = True
+        if batch:
+            yield batch
@@ -0,0 +1,85 @@
+"""Loudness measurement with ffmpeg's loudnorm filter
+
+Tracks are measured once and played back with a fixed gain, which is a lot cheaper than running the dynamic loudnorm
+filter on every play. Run as a module to measure the tracks already in the library:
+
+    python -m musabot.loudness --db musabot.db --filedir music
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+from musabot.models import Video, init_db
+
+TARGET_LUFS = -16.0
+TARGET_PEAK = -1.5
+
+
+def analyze(file, timeout=None):
+    """Returns integrated loudness, true peak and loudness range of file
+
+    Raises subprocess.TimeoutExpired if ffmpeg takes longer than timeout seconds, it is killed then.
+    """
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-i', file, '-vn',
+               '-af', f'loudnorm=I={TARGET_LUFS}:TP={TARGET_PEAK}:print_format=json', '-f', 'null', '-']
+    result = sp.run(command, stderr=sp.PIPE, text=True, check=True, timeout=timeout)
+    stats = json.loads(result.stderr[result.stderr.rindex('{'):])
+    return {'integrated_lufs': float(stats['input_i']),
+            'true_peak': float(stats['input_tp']),
+            'lra': float(stats['input_lra'])}
+
+
+def gain_db(integrated_lufs, true_peak):
+    """Gain that brings a track to the target loudness without pushing its peak over the target peak"""
+    gain = min(TARGET_LUFS - integrated_lufs, TARGET_PEAK - true_peak)
+    if not math.isfinite(gain):
+        return 0.0
+    return gain
+
+
+def audio_filter(video):
+    """Returns the ffmpeg filter normalizing video, falls back to dynamic loudnorm for unmeasured tracks"""
+    if video.get('integrated_lufs') is None or video.get('true_peak') is None:
+        return 'loudnorm'
+    return f"volume={gain_db(video['integrated_lufs'], video['true_peak']):.2f}dB"
+
+
+def backfill(filedir, workers=None):
+    """Measures every track that has no loudness stored yet, in parallel"""
+    rows = list(Video.select().where(Video.integrated_lufs.is_null()))
+    logging.info("Analysing %d tracks", len(rows))
+
+    def measure(row):
+        try:
+            return row, analyze(os.path.join(filedir, row.id))
+        except (sp.CalledProcessError, ValueError, KeyError):
+            logging.warning("Failed to analyse %s (%s)", row.id, row.title)
+            return row, None
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for row, stats in executor.map(measure, rows):
+            if stats is not None:
+                Video.update(**stats).where(Video.id == row.id).execute()
+                done += 1
+    logging.info("Analysed %d/%d tracks", done, len(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure loudness of tracks in the library')
+    parser.add_argument('--db', default='musabot.db')
+    parser.add_argument('--filedir', default='music')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    init_db(args.db)
+    backfill(args.filedir, args.workers)
+
+
+if __name__ == '__main__':
+    main()
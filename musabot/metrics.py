@@ -0,0 +1,143 @@
+"""Counters and latency histograms for the hot paths
+
+Recording is a lock and a couple of additions, the text forms are only built when !stats is used or the Prometheus
+endpoint is scraped.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def describe(self):
+        return f'{self.name}: {self.value}'
+
+    def render(self):
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter',
+                f'{self.name} {self.value}']
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q quantile falls in, inf if it is past the last bucket"""
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float('inf')
+
+    def describe(self):
+        if not self.count:
+            return f'{self.name}: no samples'
+        return (f'{self.name}: {self.count} samples, mean {self.sum / self.count * 1000:.1f} ms, '
+                f'p50 <= {self.quantile(0.5) * 1000:g} ms, p95 <= {self.quantile(0.95) * 1000:g} ms')
+
+    def render(self):
+        with self.lock:
+            counts, total, added = list(self.counts), self.count, self.sum
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{self.name}_bucket{{le="+Inf"}} {total}', f'{self.name}_sum {added}', f'{self.name}_count {total}']
+        return lines
+
+
+METRICS = []
+
+
+def counter(name, description):
+    metric = Counter(name, description)
+    METRICS.append(metric)
+    return metric
+
+
+def histogram(name, description, buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, description, buckets)
+    METRICS.append(metric)
+    return metric
+
+
+UNDERRUNS = counter('musabot_underruns_total', 'Times the output buffer ran empty while a track was playing')
+FEED_LATENESS = histogram('musabot_feed_lateness_seconds', 'How late the feed loop woke up to top up the buffer',
+                          (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5))
+FFMPEG_STARTUP = histogram('musabot_ffmpeg_startup_seconds', 'Time playback waited for the first audio of a decoder')
+YTDLP_DURATION = histogram('musabot_ytdlp_seconds', 'Time yt-dlp took to download a track')
+YOUTUBE_API_LATENCY = histogram('musabot_youtube_api_seconds', 'Latency of YouTube API metadata requests')
+DB_WRITE_DURATION = histogram('musabot_db_write_seconds', 'Time to run and commit a batch of database writes')
+
+
+def describe():
+    return [metric.describe() for metric in METRICS]
+
+
+def render():
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802 pylint: disable=invalid-name
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug("Metrics request: " + format, *args)
+
+
+def serve(port, host='127.0.0.1'):
+    """Serves the metrics in Prometheus text format on http://host:port/metrics from a background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
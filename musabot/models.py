@@ -0,0 +1,114 @@
+from peewee import Model, TextField, FloatField, IntegerField, BooleanField
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.sqlite_ext import SqliteExtDatabase, FTS5Model, SearchField
+
+# Connections are opened per thread on first use and kept open for the lifetime of the thread
+PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -16 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'foreign_keys': 1,
+}
+
+db = SqliteExtDatabase(None)
+
+
+class BaseModel(Model):
+    class Meta: # noqa
+        database = db
+
+
+class Video(BaseModel):
+    id = TextField(primary_key=True)
+    url = TextField()
+    title = TextField()
+    integrated_lufs = FloatField(null=True)
+    true_peak = FloatField(null=True)
+    lra = FloatField(null=True)
+    duration = FloatField(null=True)
+    play_count = IntegerField(default=0)
+    last_played = FloatField(null=True)
+    evicted = BooleanField(default=False)
+    # As reported by ffprobe, NULL for tracks ingested before the source stream was kept, which are all mp3
+    container = TextField(null=True)
+    codec = TextField(null=True)
+    # Size and modification time of the file when it was last found to be fine, see musabot.reconcile
+    file_size = IntegerField(null=True)
+    file_mtime = FloatField(null=True)
+
+    def as_dict(self):
+        return {'id': self.id, 'url': self.url, 'title': self.title, 'duration': self.duration,
+                'integrated_lufs': self.integrated_lufs, 'true_peak': self.true_peak, 'lra': self.lra}
+
+
+class YouTubeMeta(BaseModel):
+    """Cached YouTube API metadata, title is NULL for videos the API didn't return"""
+    id = TextField(primary_key=True)
+    title = TextField(null=True)
+    duration = FloatField(null=True)
+    fetched = FloatField()
+
+
+class VideoIndex(FTS5Model):
+    """Full text index over Video, kept in sync by triggers and sharing the rowid of the indexed Video row"""
+    video_id = SearchField(unindexed=True)
+    title = SearchField()
+    url = SearchField()
+
+    class Meta: # noqa
+        database = db
+        options = {'tokenize': "unicode61 remove_diacritics 2"}
+
+
+INDEX_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS video_index_insert AFTER INSERT ON video BEGIN
+        INSERT INTO videoindex (rowid, video_id, title, url) VALUES (new.rowid, new.id, new.title, new.url);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS video_index_delete AFTER DELETE ON video BEGIN
+        DELETE FROM videoindex WHERE rowid = old.rowid;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS video_index_update AFTER UPDATE OF title, url ON video BEGIN
+        DELETE FROM videoindex WHERE rowid = old.rowid;
+        INSERT INTO videoindex (rowid, video_id, title, url) VALUES (new.rowid, new.id, new.title, new.url);
+    END""",
+)
+
+
+def create_index():
+    """Creates the search index and fills it from Video when it is first created"""
+    fill = not VideoIndex.table_exists()
+    VideoIndex.create_table(True)
+    for trigger in INDEX_TRIGGERS:
+        db.execute_sql(trigger)
+    if fill:
+        db.execute_sql('INSERT INTO videoindex (rowid, video_id, title, url) SELECT rowid, id, title, url FROM video')
+
+
+def search(query, limit=10):
+    """Returns the ids and titles of the best matches, every word of query is matched as a prefix"""
+    words = query.split()
+    if not words:
+        return []
+    expression = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+    return [(row.video_id, row.title) for row in
+            VideoIndex.select(VideoIndex.video_id, VideoIndex.title)
+            .where(VideoIndex.match(expression)).order_by(VideoIndex.rank()).limit(limit)]
+
+
+def add_missing_columns(model):
+    """Adds columns introduced after the table was first created"""
+    existing = {column.name for column in db.get_columns(model._meta.table_name)}
+    migrator = SqliteMigrator(db)
+    operations = [migrator.add_column(model._meta.table_name, field.column_name, field)
+                  for field in model._meta.sorted_fields if field.column_name not in existing]
+    if operations:
+        migrate(*operations)
+
+
+def init_db(path):
+    db.init(path, pragmas=PRAGMAS)
+    Video.create_table(True)
+    add_missing_columns(Video)
+    YouTubeMeta.create_table(True)
+    create_index()
@@ -0,0 +1,104 @@
+import logging
+import os
+import subprocess as sp
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from musabot.player import PcmSource, ffmpeg_command
+
+# Seconds decoding one track may take, a hung ffmpeg would otherwise hold up every track after it
+INGEST_TIMEOUT = 600
+
+
+class PcmCache:
+    """Keeps normalized, decoded copies of tracks on disk within a byte budget
+
+    Files are plain 48 kHz mono s16le, so playback only has to memory map them. The modification time is bumped
+    whenever a file is played and the least recently played files are evicted first.
+    """
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pcmcache')
+        if not os.path.exists(directory):
+            logging.info("PCM cache directory does not exist, creating")
+            os.makedirs(directory)
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def path(self, videoid):
+        return os.path.join(self.directory, f'{videoid}.pcm')
+
+    def open(self, videoid, starttime=None):
+        """Returns a PcmSource for the track, or None if it is not cached"""
+        if not self.enabled:
+            return None
+        path = self.path(videoid)
+        try:
+            source = PcmSource(path, starttime)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return source
+
+    def ingest(self, file, videoid, filters='loudnorm'):
+        """Decodes file into the cache, blocks until done"""
+        if not self.enabled:
+            return
+        path = self.path(videoid)
+        tmppath = f'{path}.tmp'
+        try:
+            sp.run(ffmpeg_command(file, filters=filters, output=tmppath), check=True, timeout=INGEST_TIMEOUT)
+            os.replace(tmppath, path)
+            logging.debug("Cached PCM for %s", videoid)
+        except (sp.SubprocessError, OSError):
+            logging.exception("Failed to cache PCM for %s", videoid)
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            return
+        self.evict()
+
+    def ingest_async(self, file, videoid, filters='loudnorm'):
+        """Schedules ingest in the background, the track plays through ffmpeg until it is done"""
+        if not self.enabled:
+            return
+        with self.lock:
+            if videoid in self.pending:
+                return
+            self.pending.add(videoid)
+        self.executor.submit(self._ingest_pending, file, videoid, filters)
+
+    def _ingest_pending(self, file, videoid, filters):
+        try:
+            self.ingest(file, videoid, filters)
+        finally:
+            with self.lock:
+                self.pending.discard(videoid)
+
+    def remove(self, videoid):
+        try:
+            os.remove(self.path(videoid))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pcm'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.budget:
+                    break
+                logging.debug("Evicting %s from PCM cache", path)
+                os.remove(path)
+                total -= size
@@ -0,0 +1,144 @@
+import json
+import logging
+import mmap
+import subprocess as sp
+import threading
+import time
+
+from musabot import metrics
+
+SAMPLE_RATE = 48000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+
+def ffmpeg_command(file, starttime=None, filters='loudnorm', output='-'):
+    """Builds a ffmpeg command decoding file to 48 kHz mono s16le"""
+    command = ['ffmpeg', '-v', 'error', '-nostdin']
+    if starttime:
+        command += ['-ss', str(starttime)]
+    command += ['-i', file, '-ac', '1', '-f', 's16le', '-ar', str(SAMPLE_RATE)]
+    if filters:
+        command += ['-af', filters]
+    command.append(output)
+    return command
+
+
+def probe(file, timeout=None):
+    """Returns the container, audio codec and duration of file as reported by ffprobe, and whether it has a video stream
+
+    duration is None if ffprobe can't tell. Raises subprocess.TimeoutExpired if ffprobe takes longer than timeout.
+    """
+    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name',
+               '-of', 'json', file]
+    info = json.loads(sp.run(command, stdout=sp.PIPE, text=True, check=True, timeout=timeout).stdout)
+    streams = info.get('streams', [])
+    audio = next(stream['codec_name'] for stream in streams if stream.get('codec_type') == 'audio')
+    try:
+        duration = float(info['format']['duration'])
+    except (KeyError, ValueError):
+        duration = None
+    return {'container': info['format']['format_name'], 'codec': audio, 'duration': duration,
+            'video_stream': any(stream.get('codec_type') == 'video' for stream in streams)}
+
+
+class FfmpegSource:
+    """Decodes a file with a ffmpeg subprocess, duration is only used to estimate the remaining time"""
+
+    def __init__(self, file, starttime=None, filters='loudnorm', duration=None, stdin=None):
+        self.process = sp.Popen(ffmpeg_command(file, starttime, filters), stdin=stdin, stdout=sp.PIPE)
+        self.length = None
+        if duration:
+            self.length = max(0, int((duration - (starttime or 0)) * BYTES_PER_SECOND))
+        self.start = int((starttime or 0) * SAMPLE_RATE)
+        self.position = 0
+        self.first_read = True
+
+    @property
+    def remaining(self):
+        """Seconds of audio left, None if unknown"""
+        if self.length is None:
+            return None
+        return max(0, self.length - self.position) / BYTES_PER_SECOND
+
+    def tell(self):
+        """Samples from the start of the track up to the next one read"""
+        return self.start + self.position // 2
+
+    def read(self, size):
+        if self.first_read:
+            # Prefetched decoders have their first audio ready, so this is the startup delay playback actually sees
+            self.first_read = False
+            with metrics.FFMPEG_STARTUP.time():
+                data = self.process.stdout.read(size)
+        else:
+            data = self.process.stdout.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class StreamSource(FfmpegSource):
+    """Decodes a file that is still being downloaded
+
+    A thread follows the file as it grows and pipes it to ffmpeg, so playback neither waits for the download nor
+    slows it down. complete is set once nothing more will be written to the file.
+    """
+
+    def __init__(self, path, complete, starttime=None, filters='loudnorm', duration=None):
+        super().__init__('pipe:0', starttime, filters, duration, stdin=sp.PIPE)
+        self.complete = complete
+        self.thread = threading.Thread(target=self._pump, args=(path,), name='stream-pump', daemon=True)
+        self.thread.start()
+
+    def _pump(self, path):
+        try:
+            with open(path, 'rb') as file:
+                while True:
+                    finished = self.complete.is_set()
+                    data = file.read(65536)
+                    if data:
+                        self.process.stdin.write(data)
+                    elif finished:
+                        break
+                    else:
+                        time.sleep(0.1)
+        except (BrokenPipeError, ValueError, OSError):
+            logging.debug("Stream decoder went away")
+        finally:
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+
+class PcmSource:
+    """Reads already decoded PCM through a memory map, seeking is just moving the offset"""
+
+    def __init__(self, path, starttime=None):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+        if starttime:
+            self.seek(starttime)
+
+    @property
+    def remaining(self):
+        return (len(self.map) - self.position) / BYTES_PER_SECOND
+
+    def tell(self):
+        return self.position // 2
+
+    def seek(self, seconds):
+        self.position = min(max(0, int(seconds * BYTES_PER_SECOND)) & ~1, len(self.map))
+
+    def read(self, size):
+        data = self.map[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,124 @@
+"""Startup check that the files in the file directory and the rows in Video agree
+
+Every row remembers the size and modification time its file had when it was last found to be fine. Files that still
+match are trusted without opening them, so with an unchanged library a start costs one query and one directory
+listing. New and changed files are probed with ffprobe in parallel, on a background thread while the bot plays.
+
+- Rows whose file is gone are marked evicted, like the evictor does, so they are downloaded again when requested
+- Files ffprobe can't read or that are much shorter than their track are moved to the quarantine directory and their
+  rows marked evicted
+- Files without a row are moved to the quarantine directory
+- Evicted rows whose file is back are playable again
+
+Partial downloads and files written after the bot started are left alone.
+"""
+import logging
+import os
+import subprocess as sp
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from musabot import player
+from musabot.models import db, Video
+
+QUARANTINE = 'quarantine'
+PARTIAL_SUFFIXES = ('.part', '.tmp')
+PROBE_WORKERS = 4
+PROBE_TIMEOUT = 60
+# Seconds a file may be shorter than its track before it counts as truncated
+TRUNCATION_SLACK = 5
+
+
+class Reconciler:
+    """on_missing(videoid) is called for rows that lost their file, on_restored(videoid) for evicted rows that got it
+    back. probe defaults to ffprobe."""
+
+    def __init__(self, filedir, dbwriter, on_missing, on_restored, workers=PROBE_WORKERS, probe=None):
+        self.filedir = filedir
+        self.dbwriter = dbwriter
+        self.on_missing = on_missing
+        self.on_restored = on_restored
+        self.workers = workers
+        self.probe = probe or player.probe
+        self.started = time.time()
+
+    def start(self):
+        threading.Thread(target=self._run, name='reconciler', daemon=True).start()
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Library reconciliation failed")
+
+    def files(self):
+        return {entry.name: entry.stat() for entry in os.scandir(self.filedir)
+                if entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIXES)}
+
+    def run(self):
+        """Reconciles the library, returns how many tracks ended up in which state"""
+        start = time.perf_counter()
+        # Rows are read before the files are listed, so a download finishing in between can't look like a missing file.
+        # The raw cursor skips converting every value through its field, which is most of the time for large libraries.
+        rows = db.execute(Video.select(Video.id, Video.evicted, Video.duration, Video.file_size,
+                                       Video.file_mtime)).fetchall()
+        files = self.files()
+        counts = Counter()
+        changed = []
+        for videoid, evicted, duration, size, mtime in rows:
+            stat = files.pop(videoid, None)
+            if stat is None:
+                if not evicted:
+                    logging.warning("File of %s is missing", videoid)
+                    self.on_missing(videoid)
+                    counts['missing'] += 1
+            elif stat.st_mtime >= self.started:
+                counts['new'] += 1
+            elif evicted or (stat.st_size, stat.st_mtime) != (size, mtime):
+                changed.append((videoid, evicted, duration, stat))
+            else:
+                counts['unchanged'] += 1
+        for name, stat in files.items():
+            if stat.st_mtime < self.started:
+                logging.warning("%s has no database entry", name)
+                self.quarantine(name)
+                counts['orphaned'] += 1
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='reconcile') as pool:
+            counts.update(pool.map(self.check, changed))
+        logging.info("Reconciled %d tracks in %.1f s: %s", len(rows), time.perf_counter() - start,
+                     ', '.join(f'{count} {state}' for state, count in sorted(counts.items())))
+        return counts
+
+    def check(self, entry):
+        videoid, evicted, duration, stat = entry
+        try:
+            info = self.probe(os.path.join(self.filedir, videoid), timeout=PROBE_TIMEOUT)
+        except (sp.SubprocessError, OSError, StopIteration, ValueError, KeyError):
+            logging.warning("%s is unreadable", videoid)
+            return self.reject(videoid, evicted, 'unreadable')
+        if duration and info['duration'] is not None and info['duration'] + TRUNCATION_SLACK < duration:
+            logging.warning("%s is truncated, %.0f of %.0f seconds", videoid, info['duration'], duration)
+            return self.reject(videoid, evicted, 'truncated')
+        self.dbwriter.submit(Video.update(evicted=False, file_size=stat.st_size, file_mtime=stat.st_mtime)
+                             .where(Video.id == videoid).execute)
+        if evicted:
+            self.on_restored(videoid)
+            return 'restored'
+        return 'checked'
+
+    def reject(self, videoid, evicted, state):
+        self.quarantine(videoid)
+        if not evicted:
+            self.on_missing(videoid)
+        return state
+
+    def quarantine(self, name):
+        """Moves a file out of the way into the quarantine directory, where it can be looked at or deleted"""
+        directory = os.path.join(self.filedir, QUARANTINE)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            os.replace(os.path.join(self.filedir, name), os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,67 @@
+import random
+import threading
+
+
+class ShuffleBag:
+    """Picks tracks at random in constant time without repeating any until every track has been picked
+
+    The bag is a list of the tracks not picked yet plus an index of their positions, so picking and removing are both
+    a swap with the last element. Once the bag runs empty it is refilled from the whole library.
+    """
+
+    def __init__(self, ids=(), rng=None):
+        self.library = set(ids)
+        self.bag = []
+        self.index = {}
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self._refill()
+
+    def __len__(self):
+        return len(self.library)
+
+    def _refill(self):
+        self.bag = list(self.library)
+        self.index = {videoid: i for i, videoid in enumerate(self.bag)}
+
+    def _take(self, position):
+        videoid = self.bag[position]
+        last = self.bag.pop()
+        if position < len(self.bag):
+            self.bag[position] = last
+            self.index[last] = position
+        del self.index[videoid]
+        return videoid
+
+    def add(self, videoid):
+        """Adds a new track, or puts a picked track back if it ended up not being played"""
+        with self.lock:
+            self.library.add(videoid)
+            if videoid not in self.index:
+                self.index[videoid] = len(self.bag)
+                self.bag.append(videoid)
+
+    def extend(self, ids):
+        """Adds many tracks at once, like add for each of them"""
+        with self.lock:
+            new = set(ids) - self.library
+            self.library |= new
+            for videoid in new:
+                if videoid not in self.index:
+                    self.index[videoid] = len(self.bag)
+                    self.bag.append(videoid)
+
+    def remove(self, videoid):
+        with self.lock:
+            self.library.discard(videoid)
+            if videoid in self.index:
+                self._take(self.index[videoid])
+
+    def pick(self):
+        """Returns a random track id, or None if the library is empty"""
+        with self.lock:
+            if not self.bag:
+                self._refill()
+            if not self.bag:
+                return None
+            return self._take(self.rng.randrange(len(self.bag)))
@@ -0,0 +1,48 @@
+import json
+import logging
+import os
+import threading
+
+from musabot.debounce import Debouncer
+
+
+class StateFile:
+    """Bot state that should survive a restart, kept in a JSON file
+
+    Parts of the state are registered with a function returning their current value, which is only called when the
+    file is written. schedule() writes it shortly after a change, flush() right away.
+    """
+
+    def __init__(self, path, delay=2.0):
+        self.path = path
+        self.providers = {}
+        self.lock = threading.Lock()
+        self.debouncer = Debouncer(self.write, delay)
+        self.schedule = self.debouncer.schedule
+        self.flush = self.debouncer.flush
+        try:
+            with open(path, encoding='utf-8') as file:
+                self.saved = json.load(file)
+        except FileNotFoundError:
+            self.saved = {}
+        except (OSError, ValueError):
+            logging.exception("Could not read state file %s, starting without saved state", path)
+            self.saved = {}
+
+    def get(self, key, default=None):
+        """Returns the value key had when the state was last written"""
+        return self.saved.get(key, default)
+
+    def register(self, key, provider):
+        self.providers[key] = provider
+
+    def write(self):
+        # Providers take their owner's locks, so they are called before taking the file's
+        state = {key: provider() for key, provider in self.providers.items()}
+        with self.lock:
+            self.saved.update(state)
+            logging.debug("Writing state")
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as file:
+                json.dump(self.saved, file, separators=(',', ':'))
+            os.replace(tmp, self.path)
@@ -0,0 +1,76 @@
+"""Runs several sessions, on different servers or channels, from one config
+
+Sessions are the sections of [sessions], each overriding the top level options it sets:
+
+    [sessions]
+    [[main]]
+    [[lounge]]
+    channel = Lounge
+    [[other-server]]
+    host = mumble.example.org
+    volume = 0.2
+
+All sessions share the library, the download pool and the decoded audio cache, each has its own connection, queue,
+feed loop and state file. Sessions log in as <user>-<name> unless they set user, a server only lets one client
+use a name. Without a [sessions] section the top level options are the only session.
+"""
+import logging
+import threading
+
+from configobj import ConfigObj
+
+from musabot.bot import Musabot, Shared
+
+
+def session_configs(config):
+    """Returns (name, config, settings) for every session, settings is where the session's changes are saved
+
+    Raises ValueError if two sessions would log in to the same server under the same name.
+    """
+    sessions = config.get('sessions')
+    if not sessions:
+        return [(None, config, config)]
+    top = {key: config[key] for key in config.scalars}
+    configs = []
+    for name in sessions.sections:
+        session = ConfigObj(top)
+        session['state_file'] = f'state-{name}.json'
+        session['user'] = f"{config['user']}-{name}"
+        session.merge(sessions[name].dict())
+        configs.append((name, session, sessions[name]))
+    logins = {}
+    for name, session, _ in configs:
+        login = (session['host'], session.as_int('port'), session['user'])
+        if login in logins:
+            raise ValueError(f'Sessions {logins[login]} and {name} both log in to {login[0]}:{login[1]} as {login[2]}')
+        logins[login] = name
+    return configs
+
+
+class Supervisor:
+    def __init__(self, config, youtube=None):
+        self.shared = Shared(config, youtube)
+        self.sessions = {name: Musabot(session, shared=self.shared, settings=settings)
+                         for name, session, settings in session_configs(config)}
+
+    def connect(self):
+        for session in self.sessions.values():
+            session.connect()
+
+    def load_library(self):
+        for session in self.sessions.values():
+            session.load_library()
+
+    def run(self):
+        """Runs every session on its own thread until all of them are killed"""
+        if len(self.sessions) == 1:
+            next(iter(self.sessions.values())).run()
+            return
+        threads = []
+        for name, session in self.sessions.items():
+            logging.info("Starting session %s", name)
+            thread = threading.Thread(target=session.run, name=f'session-{name}')
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
@@ -1,6 +1,13 @@
 import hashlib
+import html
+import math
+import os
+import re
+from functools import lru_cache
 from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
+
+# Mumble sends links as <a href="...">...</a>, anything it doesn't match goes through the HTML parser
+ANCHOR_RE = re.compile(r'<a\s+href=(["\'])([^"\'<>]*)\1\s*>', re.IGNORECASE)
 
 
 def get_yt_video_id(url):
@@ -37,17 +44,61 @@ def get_yt_video_id(url):
     raise ValueError('Not a YouTube URL')
 
 
+def hash_url(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def remove_file(path):
+    """Removes a file, returns False if it was already gone"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def html_links(parameter):
+    """Returns the href of every a element in parameter"""
+    if '<' not in parameter:
+        return []
+    if parameter.lower().count('<a') == len(matches := ANCHOR_RE.findall(parameter)):
+        return [html.unescape(href) for _, href in matches]
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+    return [link.get('href') for link in BeautifulSoup(parameter, "html.parser").find_all('a')]
+
+
+@lru_cache(maxsize=1024)
 def parse_parameter(parameter):
     """Extracts an url from a HTML a element, returns it and it's sha256 hash"""
-    soup = BeautifulSoup(parameter, "html.parser")
-    try:
-        url = soup.find('a').get('href')
-    except AttributeError:
-        url = parameter
+    links = html_links(parameter)
+    url = links[0] if links and links[0] is not None else parameter
+    return url, hash_url(url)
+
+
+def parse_urls(parameter):
+    """Extracts every url from the HTML a elements in parameter, or splits it on whitespace if there are none"""
+    urls = [url for url in html_links(parameter) if url]
+    return urls or parameter.split()
+
 
-    urlhash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+@lru_cache(maxsize=4096)
+def canonical_youtube_url(videoid):
+    """Returns the url all links to a YouTube video are stored under, and it's hash"""
+    url = f'https://www.youtube.com/watch?v={videoid}'
+    return url, hash_url(url)
 
-    return url, urlhash
+
+def url_hashes(url):
+    """Returns the hashes a track for url may be stored under
+
+    YouTube videos are stored under their canonical url, but older entries may be under the url as it was given.
+    """
+    hashes = [hash_url(url)]
+    try:
+        hashes.insert(0, canonical_youtube_url(get_yt_video_id(url))[1])
+    except (ValueError, KeyError, IndexError):
+        pass
+    return hashes
 
 
 def parse_command(message):
@@ -59,6 +110,38 @@ def parse_command(message):
     return command, parameter
 
 
+POSITION_RE = re.compile(r'(?:(\d+)h)?(?:(\d+)m)?(?:(\d+(?:\.\d+)?)s)?')
+
+
+def parse_position(parameter):
+    """Parses a seek target like 90, 1:30, 1m30s, +10 or -1:00, returns seconds and whether it is relative
+
+    Raises ValueError if parameter isn't a position.
+    """
+    parameter = parameter.strip()
+    sign = -1 if parameter.startswith('-') else 1
+    body = parameter.lstrip('+-')
+    if ':' in body:
+        seconds = sum(float(part) * 60 ** power for power, part in enumerate(reversed(body.split(':'))))
+    elif body and body[-1] in 'hms':
+        match = POSITION_RE.fullmatch(body)
+        if match is None:
+            raise ValueError(f'Invalid position: {parameter}')
+        hours, minutes, secs = (float(group or 0) for group in match.groups())
+        seconds = hours * 3600 + minutes * 60 + secs
+    else:
+        seconds = float(body)
+    if not math.isfinite(seconds):
+        raise ValueError(f'Invalid position: {parameter}')
+    return sign * seconds, parameter[:1] in ('+', '-')
+
+
+def format_position(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
 def parse_timecode(url):
     starttime = None
 
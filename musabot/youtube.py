@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from isodate import parse_duration
+
+from musabot import metrics
+from musabot.models import YouTubeMeta
+
+MAX_BATCH = 50
+
+
+class VideoUnavailable(Exception):
+    """The YouTube API doesn't know the video, or it is private"""
+
+
+class YouTubeMetadata:
+    """YouTube video metadata through a local cache
+
+    Lookups missing from the cache are collected for a short window and fetched with a single videos().list call of
+    up to 50 ids. Videos the API doesn't return are cached as unavailable for negative_ttl seconds. connect returns
+    the API client and is only called once the first lookup misses the cache.
+    """
+
+    def __init__(self, connect, dbwriter, ttl, negative_ttl, window=0.05):
+        self.connect = connect
+        self.youtube = None
+        self.dbwriter = dbwriter
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.window = window
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='youtube-metadata', daemon=True)
+        self.thread.start()
+
+    def get(self, videoid, timeout=60):
+        """Returns a dict with the title and duration in seconds of the video, raises VideoUnavailable"""
+        return self.get_many([videoid], timeout)[videoid]
+
+    def get_many(self, videoids, timeout=60):
+        """Like get, but for several videos, unavailable videos are returned as VideoUnavailable instances"""
+        now = time.time()
+        results = {}
+        for row in YouTubeMeta.select().where(YouTubeMeta.id.in_(list(videoids))):
+            if row.title is not None and row.fetched + self.ttl > now:
+                results[row.id] = {'title': row.title, 'duration': row.duration}
+            elif row.title is None and row.fetched + self.negative_ttl > now:
+                results[row.id] = VideoUnavailable(row.id)
+        futures = {videoid: self._request(videoid) for videoid in videoids if videoid not in results}
+        for videoid, future in futures.items():
+            try:
+                results[videoid] = future.result(timeout)
+            except VideoUnavailable as e:
+                results[videoid] = e
+        return results
+
+    def _request(self, videoid):
+        with self.condition:
+            future = self.pending.get(videoid)
+            if future is None:
+                future = self.pending[videoid] = Future()
+                self.condition.notify()
+            return future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(self.window)
+            with self.condition:
+                batch = {}
+                for videoid in list(self.pending)[:MAX_BATCH]:
+                    batch[videoid] = self.pending.pop(videoid)
+            self._fetch(batch)
+
+    def _fetch(self, batch):
+        logging.debug("Fetching metadata for %d videos", len(batch))
+        try:
+            if self.youtube is None:
+                self.youtube = self.connect()
+            with metrics.YOUTUBE_API_LATENCY.time():
+                response = self.youtube.videos().list(part='snippet, contentDetails', id=','.join(batch),
+                                                      maxResults=MAX_BATCH).execute()
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception("YouTube metadata request failed")
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        now = time.time()
+        rows = []
+        for item in response.get('items', []):
+            metadata = {'title': item['snippet']['title'],
+                        'duration': parse_duration(item['contentDetails']['duration']).total_seconds()}
+            rows.append({'id': item['id'], 'fetched': now, **metadata})
+            if item['id'] in batch:
+                batch.pop(item['id']).set_result(metadata)
+        for videoid, future in batch.items():
+            rows.append({'id': videoid, 'fetched': now, 'title': None, 'duration': None})
+            future.set_exception(VideoUnavailable(videoid))
+        self.dbwriter.submit(lambda: YouTubeMeta.insert_many(rows).on_conflict_replace().execute())